@@ -53,7 +53,9 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+    user = db.query(models.User).filter(
+        models.User.id == user_id, models.User.deleted_at.is_(None)
+    ).first()
     if user is None:
         raise credentials_exception
     return user
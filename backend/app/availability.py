@@ -0,0 +1,90 @@
+"""Sitter availability.
+
+Pending and confirmed bookings hold one of the sitter's `max_dogs` places
+for their [start_date, end_date) interval. Bookings are capped at
+MAX_BOOKING_DAYS, so every booking overlapping a window starts inside
+[window start - MAX_BOOKING_DAYS, window end): an overlap lookup is one
+range scan of the (sitter_id, start_date, end_date) index, never a scan of
+the sitter's whole history. The peak load over the window is then a sweep
+over the few bookings found.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+
+ACTIVE_STATUSES = ("pending", "confirmed")
+MAX_BOOKING_DAYS = 60
+
+B = models.SitterBooking
+Interval = Tuple[datetime, datetime]
+
+
+def as_utc(ts: datetime) -> datetime:
+    """Naive UTC, the way dates are stored."""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def overlapping(db: Session, sitter_ids: Iterable[int], start: datetime, end: datetime,
+                exclude_id: Optional[int] = None) -> Dict[int, List[Interval]]:
+    """Active booking intervals of each sitter overlapping [start, end)."""
+    query = db.query(B.sitter_id, B.start_date, B.end_date).filter(
+        B.sitter_id.in_(list(sitter_ids)),
+        B.start_date >= start - timedelta(days=MAX_BOOKING_DAYS),
+        B.start_date < end,
+        B.end_date > start,
+        B.status.in_(ACTIVE_STATUSES),
+    )
+    if exclude_id is not None:
+        query = query.filter(B.id != exclude_id)
+    found = defaultdict(list)
+    for sitter_id, s, e in query:
+        found[sitter_id].append((s, e))
+    return found
+
+
+def segments(intervals: List[Interval], start: datetime, end: datetime) -> List[Tuple[datetime, datetime, int]]:
+    """Split [start, end) into (from, to, dogs booked) pieces of constant load."""
+    events = defaultdict(int)
+    for s, e in intervals:
+        events[max(s, start)] += 1
+        events[min(e, end)] -= 1
+    events.setdefault(start, 0)
+    events.setdefault(end, 0)
+    points = sorted(events)
+    pieces, load = [], 0
+    for a, b in zip(points, points[1:]):
+        load += events[a]
+        if pieces and pieces[-1][2] == load:
+            pieces[-1] = (pieces[-1][0], b, load)
+        else:
+            pieces.append((a, b, load))
+    return pieces
+
+
+def peak_load(intervals: List[Interval], start: datetime, end: datetime) -> int:
+    return max((load for _, _, load in segments(intervals, start, end)), default=0)
+
+
+def has_room(db: Session, sitter: models.SitterProfile, start: datetime, end: datetime,
+             exclude_id: Optional[int] = None) -> bool:
+    intervals = overlapping(db, [sitter.id], start, end, exclude_id).get(sitter.id, [])
+    return peak_load(intervals, start, end) < (sitter.max_dogs or 1)
+
+
+def full_sitters(db: Session, sitters: Iterable[models.SitterProfile],
+                 start: datetime, end: datetime) -> Set[int]:
+    """Ids of the sitters with no place left at some point of [start, end)."""
+    capacity = {s.id: s.max_dogs or 1 for s in sitters}
+    if not capacity:
+        return set()
+    found = overlapping(db, capacity, start, end)
+    return {
+        sitter_id for sitter_id, intervals in found.items()
+        if peak_load(intervals, start, end) >= capacity[sitter_id]
+    }
@@ -0,0 +1,68 @@
+"""In-process periodic jobs.
+
+Jobs run on a single daemon thread (never on the event loop). Each run gets
+its own DB session. Set BACKGROUND_JOBS=0 to disable the scheduler, e.g. for
+one-off scripts.
+"""
+import heapq
+import os
+import threading
+import time
+
+from .database import SessionLocal
+
+ENABLED = os.getenv("BACKGROUND_JOBS", "1") != "0"
+
+_jobs = {}  # name -> (interval_seconds, fn)
+_thread = None
+_stop = threading.Event()
+
+
+def register(name: str, interval_seconds: float):
+    """Decorator registering `fn(db)` to run every `interval_seconds`."""
+    def decorator(fn):
+        _jobs[name] = (interval_seconds, fn)
+        return fn
+    return decorator
+
+
+def run_job(name: str):
+    interval, fn = _jobs[name]
+    db = SessionLocal()
+    try:
+        fn(db)
+    except Exception as e:
+        db.rollback()
+        print(f"[WoofWoof] Background job {name} failed: {e}")
+    finally:
+        db.close()
+
+
+def _loop():
+    now = time.monotonic()
+    # Time wheel: (next_run, name), earliest first
+    schedule = [(now, name) for name in _jobs]
+    heapq.heapify(schedule)
+    while schedule and not _stop.is_set():
+        next_run, name = schedule[0]
+        delay = next_run - time.monotonic()
+        if delay > 0:
+            _stop.wait(delay)
+            continue
+        heapq.heappop(schedule)
+        run_job(name)
+        interval, _ = _jobs[name]
+        heapq.heappush(schedule, (max(next_run + interval, time.monotonic()), name))
+
+
+def start():
+    global _thread
+    if not ENABLED or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="woofwoof-jobs", daemon=True)
+    _thread.start()
+
+
+def stop():
+    _stop.set()
@@ -0,0 +1,190 @@
+"""Server-side marker clustering for the map layers.
+
+Supercluster-style: points are greedily merged with their neighbours within
+RADIUS (a fraction of a tile width) zoom by zoom, from MAX_ZOOM down to 0,
+each zoom clustering the clusters of the zoom above. Every zoom is kept in
+its own GridIndex so a bbox query only touches the visible cells.
+
+Layers are built lazily per worker, refreshed in the background every
+REFRESH_SECONDS, and new points are merged into every zoom on insert so
+they show up immediately.
+"""
+import itertools
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import background, models
+from .spatial import KM_PER_DEG, Entry, GridIndex
+
+MIN_ZOOM = 0
+MAX_ZOOM = 16
+RADIUS = 40 / 512  # cluster radius, in tile widths
+REFRESH_SECONDS = 300
+
+
+def _radius_deg(zoom: int) -> float:
+    return RADIUS * 360.0 / (1 << zoom)
+
+
+def _radius_km(zoom: int, lat: float) -> float:
+    return _radius_deg(zoom) * KM_PER_DEG * max(math.cos(math.radians(lat)), 0.01)
+
+
+class Supercluster:
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._points = GridIndex(_radius_deg(MAX_ZOOM))
+        self._zooms: Dict[int, GridIndex] = {}
+
+    def load(self, points: Iterable[Entry]):
+        """Cluster a full set of points, one zoom at a time."""
+        level = []
+        for id, lat, lng, props in points:
+            self._points.insert(id, lat, lng, props)
+            level.append((next(self._ids), lat, lng, {"count": 1, "point_id": id, **props}))
+        for zoom in range(MAX_ZOOM, MIN_ZOOM - 1, -1):
+            previous = GridIndex(_radius_deg(zoom))
+            for entry in level:
+                previous.insert(*entry)
+            merged = set()
+            clusters = GridIndex(_radius_deg(zoom))
+            for id, lat, lng, payload in level:
+                if id in merged:
+                    continue
+                merged.add(id)
+                members = [
+                    e for _, e in previous.within(lat, lng, _radius_km(zoom, lat))
+                    if e[0] not in merged
+                ]
+                if not members:
+                    clusters.insert(id, lat, lng, payload)
+                    continue
+                count, wlat, wlng = payload["count"], lat * payload["count"], lng * payload["count"]
+                for e in members:
+                    merged.add(e[0])
+                    n = e[3]["count"]
+                    count, wlat, wlng = count + n, wlat + e[1] * n, wlng + e[2] * n
+                clusters.insert(next(self._ids), wlat / count, wlng / count, {"count": count})
+            self._zooms[zoom] = clusters
+            level = list(clusters.entries())
+
+    def insert(self, id: int, lat: float, lng: float, props: dict):
+        """Merge one new point into the nearest cluster of every zoom."""
+        if id in self._points:
+            return
+        self._points.insert(id, lat, lng, props)
+        for zoom in range(MAX_ZOOM, MIN_ZOOM - 1, -1):
+            index = self._zooms.setdefault(zoom, GridIndex(_radius_deg(zoom)))
+            hit = index.nearest(lat, lng, 1, max_radius_km=_radius_km(zoom, lat))
+            if not hit:
+                index.insert(next(self._ids), lat, lng, {"count": 1, "point_id": id, **props})
+                continue
+            cid, clat, clng, payload = hit[0][1]
+            n = payload["count"]
+            index.insert(cid, (clat * n + lat) / (n + 1), (clng * n + lng) / (n + 1), {"count": n + 1})
+
+    def get_clusters(self, south: float, west: float, north: float, east: float, zoom: int) -> List[dict]:
+        if zoom > MAX_ZOOM:
+            return [
+                {"id": id, "lat": lat, "lng": lng, "count": 1, "point_id": id, **props}
+                for id, lat, lng, props in self._points.in_bbox(south, west, north, east)
+            ]
+        index = self._zooms.get(max(zoom, MIN_ZOOM))
+        if index is None:
+            return []
+        return [
+            {"id": id, "lat": lat, "lng": lng, **payload}
+            for id, lat, lng, payload in index.in_bbox(south, west, north, east)
+        ]
+
+
+class ClusterLayer:
+    def __init__(self, name: str, loader: Callable[[Session], Iterable[Entry]]):
+        self.name = name
+        self._loader = loader
+        self._lock = threading.Lock()
+        self._clusters: Optional[Supercluster] = None
+        self._pending = None  # inserts seen while a rebuild is running
+        self.built_at = 0.0
+
+    def _points(self, db: Session):
+        return [
+            (id, lat, lng, props) for id, lat, lng, props in self._loader(db)
+            if lat is not None and lng is not None
+        ]
+
+    def get_clusters(self, db: Session, south: float, west: float, north: float, east: float,
+                     zoom: int) -> List[dict]:
+        # Under the lock: `add` merges points into the live indexes
+        with self._lock:
+            if self._clusters is None:
+                self._clusters = Supercluster()
+                self._clusters.load(self._points(db))
+                self.built_at = time.monotonic()
+            return self._clusters.get_clusters(south, west, north, east, zoom)
+
+    def rebuild(self, db: Session):
+        """Recluster from the DB, picking up other workers' inserts."""
+        with self._lock:
+            self._pending = []
+        clusters = Supercluster()
+        clusters.load(self._points(db))
+        with self._lock:
+            for point in self._pending:
+                clusters.insert(*point)
+            self._pending = None
+            self._clusters = clusters
+            self.built_at = time.monotonic()
+
+    def add(self, id: int, lat: Optional[float], lng: Optional[float], props: dict):
+        if lat is None or lng is None:
+            return
+        with self._lock:
+            if self._clusters is not None:
+                self._clusters.insert(id, lat, lng, props)
+            if self._pending is not None:
+                self._pending.append((id, lat, lng, props))
+
+
+def _load_spots(db: Session):
+    for r in db.query(models.WalkSpot.id, models.WalkSpot.latitude, models.WalkSpot.longitude,
+                      models.WalkSpot.name, models.WalkSpot.spot_type):
+        yield r.id, r.latitude, r.longitude, {"name": r.name, "type": r.spot_type}
+
+
+def _load_places(db: Session):
+    P = models.PetFriendlyPlace
+    for r in db.query(P.id, P.latitude, P.longitude, P.name, P.place_type):
+        yield r.id, r.latitude, r.longitude, {"name": r.name, "type": r.place_type}
+
+
+def _load_vets(db: Session):
+    V = models.VetClinic
+    for r in db.query(V.id, V.latitude, V.longitude, V.name):
+        yield r.id, r.latitude, r.longitude, {"name": r.name, "type": "vet"}
+
+
+def _load_danger_zones(db: Session):
+    D = models.DangerZone
+    for r in db.query(D.id, D.latitude, D.longitude, D.alert_type):
+        yield r.id, r.latitude, r.longitude, {"name": None, "type": r.alert_type}
+
+
+LAYERS = {
+    "spots": ClusterLayer("spots", _load_spots),
+    "places": ClusterLayer("places", _load_places),
+    "vets": ClusterLayer("vets", _load_vets),
+    "danger": ClusterLayer("danger", _load_danger_zones),
+}
+
+
+@background.register("clusters", REFRESH_SECONDS)
+def refresh_layers(db: Session):
+    for layer in LAYERS.values():
+        # Layers nobody has asked for yet stay unbuilt
+        if layer.built_at:
+            layer.rebuild(db)
@@ -0,0 +1,314 @@
+"""Deferred cascading deletion for posts, dogs and accounts.
+
+Deleting an entity only stamps `deleted_at` and queues a DeletionJob, so the
+request returns immediately and readers stop seeing the row. A background
+job then purges dependent rows across the hubs in small committed batches,
+so no single transaction holds the SQLite write lock for long.
+
+A purge plan is an ordered list of steps `(model, criterion, nullify, hook)`:
+rows of `model` matching `criterion` are deleted (or get their `nullify`
+column set to NULL) in chunks of BATCH_SIZE. Children come before parents.
+
+A worker claims a job with a compare-and-set lease before touching it and
+renews the lease, checked by rowcount, at the start of every chunk's
+transaction, so hooks such as counter updates never run twice for a chunk.
+"""
+import os
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import Session
+
+from . import background, heatmap, models, reservations
+from .walk_routes import remove_archives
+
+BATCH_SIZE = int(os.getenv("DELETION_BATCH_SIZE", "500"))
+CHUNKS_PER_RUN = int(os.getenv("DELETION_CHUNKS_PER_RUN", "20"))
+RUN_EVERY_SECONDS = 5
+LEASE_SECONDS = 300
+
+J = models.DeletionJob
+
+
+def _step(model, criterion, nullify=None, hook=None):
+    return (model, criterion, nullify, hook)
+
+
+def _uncount_likes(db: Session, ids: list):
+    """Keep `Post.likes_count` right when a deleted user's likes go away."""
+    rows = db.query(models.PostLike.post_id).filter(models.PostLike.id.in_(ids))
+    for post_id, n in Counter(r.post_id for r in rows).items():
+        db.query(models.Post).filter(models.Post.id == post_id).update(
+            {models.Post.likes_count: models.Post.likes_count - n},
+            synchronize_session=False,
+        )
+
+
+def _uncount_comments(db: Session, ids: list):
+    rows = db.query(models.PostComment.post_id).filter(models.PostComment.id.in_(ids))
+    for post_id, n in Counter(r.post_id for r in rows).items():
+        db.query(models.Post).filter(models.Post.id == post_id).update(
+            {models.Post.comments_count: models.Post.comments_count - n},
+            synchronize_session=False,
+        )
+
+
+def _uncount_reviews(db: Session, ids: list):
+    """Take purged reviews out of their sitters' rating and ranking."""
+    R = models.SitterReview
+    rows = (
+        db.query(R.sitter_id, func.count(R.id), func.sum(R.rating))
+        .filter(R.id.in_(ids))
+        .group_by(R.sitter_id)
+    )
+    for sitter_id, n, total in rows:
+        db.query(models.SitterProfile).filter(models.SitterProfile.id == sitter_id).update(
+            models.sitter_rating_update(-(total or 0), -n), synchronize_session=False,
+        )
+
+
+def _forget_walks(db: Session, ids: list):
+    heatmap.remove_walks(db, ids)
+    remove_archives(db, ids)
+
+
+def post_steps(post_ids) -> list:
+    return [
+        _step(models.PostLike, models.PostLike.post_id.in_(post_ids)),
+        _step(models.PostComment, models.PostComment.post_id.in_(post_ids)),
+        _step(models.Post, models.Post.id.in_(post_ids)),
+    ]
+
+
+def dog_steps(dog_ids) -> list:
+    match_ids = select(models.Match.id).where(
+        or_(models.Match.dog_1_id.in_(dog_ids), models.Match.dog_2_id.in_(dog_ids))
+    )
+    booking_ids = select(models.SitterBooking.id).where(
+        models.SitterBooking.dog_id.in_(dog_ids)
+    )
+    alert_ids = select(models.LostPetAlert.id).where(
+        models.LostPetAlert.dog_id.in_(dog_ids)
+    )
+    walk_ids = select(models.Walk.id).where(models.Walk.dog_id.in_(dog_ids))
+    return [
+        _step(models.Message, models.Message.match_id.in_(match_ids)),
+        _step(models.Match, models.Match.id.in_(match_ids)),
+        _step(models.Swipe, or_(
+            models.Swipe.swiper_dog_id.in_(dog_ids),
+            models.Swipe.swiped_dog_id.in_(dog_ids),
+        )),
+        _step(models.WalkTrackState, models.WalkTrackState.walk_id.in_(walk_ids)),
+        _step(models.WalkRouteLevel, models.WalkRouteLevel.walk_id.in_(walk_ids)),
+        _step(models.Walk, models.Walk.id.in_(walk_ids), hook=_forget_walks),
+        _step(models.WalkStatsRollup, models.WalkStatsRollup.dog_id.in_(dog_ids)),
+        _step(models.Meal, models.Meal.dog_id.in_(dog_ids)),
+        _step(models.NutritionDailyRollup, models.NutritionDailyRollup.dog_id.in_(dog_ids)),
+        _step(models.MealPlan, models.MealPlan.dog_id.in_(dog_ids)),
+        _step(models.HealthRecord, models.HealthRecord.dog_id.in_(dog_ids)),
+        _step(models.VetVaccination, models.VetVaccination.dog_id.in_(dog_ids)),
+        _step(models.VetAppointment, models.VetAppointment.dog_id.in_(dog_ids)),
+        _step(models.NotificationOutbox, models.NotificationOutbox.dog_id.in_(dog_ids)),
+        _step(models.SitterReview, models.SitterReview.booking_id.in_(booking_ids), hook=_uncount_reviews),
+        _step(models.SitterBooking, models.SitterBooking.id.in_(booking_ids)),
+        _step(models.UserTrainingProgress, models.UserTrainingProgress.dog_id.in_(dog_ids)),
+        _step(models.TravelChecklist, models.TravelChecklist.dog_id.in_(dog_ids)),
+        _step(models.InsuranceClaim, models.InsuranceClaim.dog_id.in_(dog_ids)),
+        _step(models.PetTag, models.PetTag.dog_id.in_(dog_ids)),
+        _step(models.LostPetSighting, models.LostPetSighting.alert_id.in_(alert_ids)),
+        _step(models.LostPetAlert, models.LostPetAlert.id.in_(alert_ids)),
+        _step(models.PedigreeEntry, models.PedigreeEntry.dog_id.in_(dog_ids)),
+        _step(models.Post, models.Post.dog_id.in_(dog_ids), nullify=models.Post.dog_id),
+        _step(models.Dog, models.Dog.id.in_(dog_ids)),
+    ]
+
+
+def user_steps(user_id: int) -> list:
+    dog_ids = select(models.Dog.id).where(models.Dog.owner_id == user_id)
+    post_ids = select(models.Post.id).where(models.Post.user_id == user_id)
+    sitter_ids = select(models.SitterProfile.id).where(
+        models.SitterProfile.user_id == user_id
+    )
+    order_ids = select(models.Order.id).where(models.Order.user_id == user_id)
+    alert_ids = select(models.LostPetAlert.id).where(
+        models.LostPetAlert.user_id == user_id
+    )
+    breeder_ids = select(models.BreederProfile.id).where(
+        models.BreederProfile.user_id == user_id
+    )
+    food_ids = select(models.FoodProduct.id).where(
+        models.FoodProduct.user_id == user_id
+    )
+    user_walk_ids = select(models.Walk.id).where(models.Walk.user_id == user_id)
+    return dog_steps(dog_ids) + post_steps(post_ids) + [
+        _step(models.PostLike, models.PostLike.user_id == user_id, hook=_uncount_likes),
+        _step(models.PostComment, models.PostComment.user_id == user_id, hook=_uncount_comments),
+        _step(models.Follow, or_(
+            models.Follow.follower_id == user_id,
+            models.Follow.followed_id == user_id,
+        )),
+        _step(models.Message, models.Message.sender_id == user_id),
+        _step(models.Subscription, models.Subscription.user_id == user_id),
+        _step(models.NotificationOutbox, models.NotificationOutbox.user_id == user_id),
+        _step(models.WalkTrackState, models.WalkTrackState.walk_id.in_(user_walk_ids)),
+        _step(models.WalkRouteLevel, models.WalkRouteLevel.walk_id.in_(user_walk_ids)),
+        _step(models.Walk, models.Walk.id.in_(user_walk_ids), hook=_forget_walks),
+        _step(models.WalkLeaderboardEntry, models.WalkLeaderboardEntry.user_id == user_id),
+        _step(models.WalkSpot, models.WalkSpot.added_by == user_id, nullify=models.WalkSpot.added_by),
+        _step(models.Meal, models.Meal.food_product_id.in_(food_ids), nullify=models.Meal.food_product_id),
+        _step(models.FoodProduct, models.FoodProduct.id.in_(food_ids)),
+        _step(models.SitterReview, or_(
+            models.SitterReview.sitter_id.in_(sitter_ids),
+            models.SitterReview.reviewer_id == user_id,
+        ), hook=_uncount_reviews),
+        _step(models.SitterBooking, or_(
+            models.SitterBooking.sitter_id.in_(sitter_ids),
+            models.SitterBooking.owner_id == user_id,
+        )),
+        _step(models.SitterProfile, models.SitterProfile.id.in_(sitter_ids)),
+        _step(models.CartItem, models.CartItem.user_id == user_id, hook=reservations.release_items),
+        _step(models.OrderItem, models.OrderItem.order_id.in_(order_ids)),
+        _step(models.Order, models.Order.id.in_(order_ids)),
+        _step(models.UserTrainingProgress, models.UserTrainingProgress.user_id == user_id),
+        _step(models.AdoptionRequest, models.AdoptionRequest.user_id == user_id),
+        _step(models.PetFriendlyPlace, models.PetFriendlyPlace.added_by == user_id,
+              nullify=models.PetFriendlyPlace.added_by),
+        _step(models.TravelChecklist, models.TravelChecklist.user_id == user_id),
+        _step(models.InsuranceClaim, models.InsuranceClaim.user_id == user_id),
+        _step(models.LostPetSighting, or_(
+            models.LostPetSighting.alert_id.in_(alert_ids),
+            models.LostPetSighting.user_id == user_id,
+        )),
+        _step(models.LostPetAlert, models.LostPetAlert.id.in_(alert_ids)),
+        _step(models.Litter, models.Litter.breeder_id.in_(breeder_ids)),
+        _step(models.BreederProfile, models.BreederProfile.id.in_(breeder_ids)),
+        _step(models.DangerZone, models.DangerZone.user_id == user_id),
+        _step(models.User, models.User.id == user_id),
+    ]
+
+
+PLANS = {
+    "post": lambda entity_id: post_steps([entity_id]),
+    "dog": lambda entity_id: dog_steps([entity_id]),
+    "user": user_steps,
+}
+
+
+def schedule_deletion(db: Session, entity_type: str, entity) -> models.DeletionJob:
+    """Hide `entity` right away and queue the purge of everything under it.
+
+    An account hides its dogs and posts too, so discover, feeds and
+    trending drop them without waiting for the purge."""
+    now = datetime.utcnow()
+    entity.deleted_at = now
+    if entity_type == "user":
+        for model, owner in ((models.Dog, models.Dog.owner_id), (models.Post, models.Post.user_id)):
+            db.query(model).filter(owner == entity.id, model.deleted_at.is_(None)).update(
+                {model.deleted_at: now}, synchronize_session=False
+            )
+    job = models.DeletionJob(entity_type=entity_type, entity_id=entity.id)
+    db.add(job)
+    db.commit()
+    return job
+
+
+def _run_chunk(db: Session, step) -> bool:
+    """Purge one batch for `step`. Returns False once nothing is left."""
+    model, criterion, nullify, hook = step
+    query = db.query(model.id).filter(criterion)
+    if nullify is not None:
+        query = query.filter(nullify.isnot(None))
+    ids = [row.id for row in query.limit(BATCH_SIZE)]
+    if not ids:
+        return False
+    if hook:
+        hook(db, ids)
+    target = db.query(model).filter(model.id.in_(ids))
+    if nullify is not None:
+        target.update({nullify: None}, synchronize_session=False)
+    else:
+        target.delete(synchronize_session=False)
+    db.commit()
+    return True
+
+
+def _claim(db: Session, job_id: int):
+    """Lease job `job_id` to this worker; returns the lease token or None."""
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    claimed = (
+        db.query(J)
+        .filter(
+            J.id == job_id,
+            J.status == "pending",
+            or_(J.claimed_until.is_(None), J.claimed_until < now),
+        )
+        .update(
+            {J.claimed_by: token, J.claimed_until: now + timedelta(seconds=LEASE_SECONDS)},
+            synchronize_session=False,
+        )
+    )
+    if not claimed:
+        db.rollback()
+        return None
+    db.commit()
+    return token
+
+
+def _renew(db: Session, job_id: int, token: str) -> bool:
+    """Extend our lease, opening the write transaction; False if lost."""
+    return bool(
+        db.query(J)
+        .filter(J.id == job_id, J.claimed_by == token)
+        .update(
+            {J.claimed_until: datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)},
+            synchronize_session=False,
+        )
+    )
+
+
+def process_job(db: Session, job: models.DeletionJob, max_chunks: int = CHUNKS_PER_RUN) -> int:
+    """Advance `job` by at most `max_chunks` batches; returns chunks used.
+
+    Does nothing if another worker holds the job."""
+    token = _claim(db, job.id)
+    if token is None:
+        return 0
+    steps = PLANS[job.entity_type](job.entity_id)
+    used = 0
+    while used < max_chunks:
+        if not _renew(db, job.id, token):
+            db.rollback()
+            return used
+        db.refresh(job)
+        if job.step >= len(steps):
+            job.status = "done"
+            job.finished_at = datetime.utcnow()
+            break
+        if _run_chunk(db, steps[job.step]):
+            used += 1
+        else:
+            job.step += 1
+            db.commit()
+    db.query(J).filter(J.id == job.id, J.claimed_by == token).update(
+        {J.claimed_by: None, J.claimed_until: None}, synchronize_session=False
+    )
+    db.commit()
+    return used
+
+
+@background.register("deletion", RUN_EVERY_SECONDS)
+def purge_pending(db: Session):
+    budget = CHUNKS_PER_RUN
+    jobs = (
+        db.query(J)
+        .filter(J.status == "pending")
+        .order_by(J.id)
+        .all()
+    )
+    for job in jobs:
+        if budget <= 0:
+            break
+        budget -= process_job(db, job, budget)
@@ -0,0 +1,77 @@
+"""Geographic helpers shared by the map-based hubs."""
+from math import asin, cos, radians, sin, sqrt
+from typing import Optional, Sequence, Tuple
+
+EARTH_RADIUS_KM = 6371.0
+
+Point = Tuple[float, float]
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    lat1, lng1, lat2, lng2 = map(radians, (lat1, lng1, lat2, lng2))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(min(a, 1.0)))
+
+
+def path_length_km(points: Sequence[Point], start: Optional[Point] = None) -> float:
+    """Length of a GPS track; `start` is the point preceding the batch, if any.
+
+    Converts the whole batch to radians once and sums segment lengths in a
+    single pass over the consecutive pairs.
+    """
+    if start is not None:
+        points = [start, *points]
+    if len(points) < 2:
+        return 0.0
+    lats = [radians(p[0]) for p in points]
+    lngs = [radians(p[1]) for p in points]
+    coss = [cos(lat) for lat in lats]
+    total = 0.0
+    for i in range(1, len(points)):
+        a = (
+            sin((lats[i] - lats[i - 1]) / 2) ** 2
+            + coss[i - 1] * coss[i] * sin((lngs[i] - lngs[i - 1]) / 2) ** 2
+        )
+        total += asin(sqrt(min(a, 1.0)))
+    return 2 * EARTH_RADIUS_KM * total
+
+
+def simplify(points: Sequence[Point], tolerance_m: float) -> list:
+    """Douglas-Peucker simplification of a track, tolerance in metres.
+
+    Points are projected on a local equirectangular plane around the first
+    fix, which is accurate enough at walk scale.
+    """
+    n = len(points)
+    if n < 3 or tolerance_m <= 0:
+        return list(points)
+    lat0 = radians(points[0][0])
+    kx = EARTH_RADIUS_KM * 1000 * cos(lat0)
+    ky = EARTH_RADIUS_KM * 1000
+    xs = [radians(p[1]) * kx for p in points]
+    ys = [radians(p[0]) * ky for p in points]
+
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    tol2 = tolerance_m ** 2
+    while stack:
+        first, last = stack.pop()
+        dx, dy = xs[last] - xs[first], ys[last] - ys[first]
+        seg2 = dx * dx + dy * dy
+        worst, worst_d2 = -1, tol2
+        for i in range(first + 1, last):
+            px, py = xs[i] - xs[first], ys[i] - ys[first]
+            if seg2 == 0:
+                d2 = px * px + py * py
+            else:
+                t = max(0.0, min(1.0, (px * dx + py * dy) / seg2))
+                ex, ey = px - t * dx, py - t * dy
+                d2 = ex * ex + ey * ey
+            if d2 > worst_d2:
+                worst, worst_d2 = i, d2
+        if worst != -1:
+            keep[worst] = True
+            stack.append((first, worst))
+            stack.append((worst, last))
+    return [p for p, k in zip(points, keep) if k]
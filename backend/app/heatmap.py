@@ -0,0 +1,243 @@
+"""Walk activity heatmap on slippy-map tiles.
+
+Each tile z/x/y is split into CELLS x CELLS cells holding the number of
+walks that crossed them. A background job picks up completed walks not yet
+`in_heatmap`, rasterises their route once at MAX_ZOOM and derives the
+coarser zooms by integer shifts, so a walk counts at most once per cell.
+Tiles carry a `version` bumped on every change; rendered PNGs of tiles
+with data are cached on disk under that version.
+"""
+import functools
+import glob
+import io
+import math
+import os
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from PIL import Image, ImageDraw, ImageFilter
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from . import background, models, polyline
+from .database import DATA_DIR
+
+CELLS = 32  # per tile side, i.e. 8 px cells on a 256 px tile
+MIN_ZOOM = 8
+MAX_ZOOM = 16
+TILE_SIZE = 256
+BATCH_WALKS = 200
+RUN_EVERY_SECONDS = 60
+# Count that saturates the colour ramp (log scale)
+SATURATION = int(os.getenv("HEATMAP_SATURATION", "50"))
+TILE_DIR = os.path.join(DATA_DIR, "heatmap_tiles")
+
+_SHIFT = int(math.log2(CELLS))
+_MAX_LAT = 85.05112878
+
+
+def _grid(lat: float, lng: float) -> tuple:
+    """Global cell coordinates (fractional) at MAX_ZOOM."""
+    n = (1 << MAX_ZOOM) * CELLS
+    lat = max(-_MAX_LAT, min(_MAX_LAT, lat))
+    phi = math.radians(lat)
+    x = (lng + 180.0) / 360.0 * n
+    y = (1.0 - math.log(math.tan(phi) + 1.0 / math.cos(phi)) / math.pi) / 2.0 * n
+    return min(max(x, 0.0), n - 1), min(max(y, 0.0), n - 1)
+
+
+def walk_cells(points) -> set:
+    """Cells at MAX_ZOOM crossed by a track, filling gaps along segments."""
+    cells = set()
+    prev = None
+    for lat, lng in points:
+        x, y = _grid(lat, lng)
+        if prev is not None:
+            px, py = prev
+            steps = int(max(abs(x - px), abs(y - py)))
+            for i in range(1, steps):
+                t = i / steps
+                cells.add((int(px + (x - px) * t), int(py + (y - py) * t)))
+        cells.add((int(x), int(y)))
+        prev = (x, y)
+    return cells
+
+
+def cells_by_zoom(cells: set) -> Counter:
+    """Spread MAX_ZOOM cells over every zoom, one count per distinct cell."""
+    counts = Counter()
+    for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+        shift = MAX_ZOOM - zoom
+        for gx, gy in {(gx >> shift, gy >> shift) for gx, gy in cells}:
+            counts[(zoom, gx, gy)] += 1
+    return counts
+
+
+def _walk_counts(walks: Iterable[models.Walk]) -> Counter:
+    counts = Counter()
+    for walk in walks:
+        if walk.route_polyline:
+            counts.update(cells_by_zoom(walk_cells(polyline.iter_decode(walk.route_polyline))))
+    return counts
+
+
+def apply(db: Session, counts: Counter, sign: int = 1):
+    """Add (or with sign=-1, remove) cell counts, one tile at a time."""
+    by_tile = defaultdict(dict)
+    for (zoom, gx, gy), n in counts.items():
+        key = (zoom, gx >> _SHIFT, gy >> _SHIFT)
+        by_tile[key][(gy & (CELLS - 1)) * CELLS + (gx & (CELLS - 1))] = n * sign
+
+    T, C = models.WalkHeatTile, models.WalkHeatCell
+    now = datetime.utcnow()
+    for (zoom, tx, ty), deltas in by_tile.items():
+        tile = db.query(T).filter(T.zoom == zoom, T.tile_x == tx, T.tile_y == ty).first()
+        if tile is None:
+            if sign < 0:
+                continue
+            tile = T(zoom=zoom, tile_x=tx, tile_y=ty, version=0, max_count=0)
+            db.add(tile)
+            db.flush()
+        existing = {
+            c.cell: c for c in db.query(C).filter(C.tile_id == tile.id, C.cell.in_(list(deltas)))
+        }
+        for cell, delta in deltas.items():
+            row = existing.get(cell)
+            if row is None:
+                if delta > 0:
+                    db.add(C(tile_id=tile.id, cell=cell, count=delta))
+            else:
+                row.count = max(0, row.count + delta)
+        db.flush()
+        tile.max_count = db.query(func.max(C.count)).filter(C.tile_id == tile.id).scalar() or 0
+        tile.version = (tile.version or 0) + 1
+        tile.updated_at = now
+
+
+@background.register("heatmap", RUN_EVERY_SECONDS)
+def index_new_walks(db: Session):
+    W = models.Walk
+    walks = (
+        db.query(W)
+        .filter(W.in_heatmap == False, or_(W.status.is_(None), W.status != "live"))
+        .order_by(W.id)
+        .limit(BATCH_WALKS)
+        .all()
+    )
+    if not walks:
+        return
+    ids = [w.id for w in walks]
+    # Claim the batch first: another worker running the same job gets
+    # fewer rows and backs off instead of counting the walks twice.
+    claimed = (
+        db.query(W)
+        .filter(W.id.in_(ids), W.in_heatmap == False)
+        .update({W.in_heatmap: True}, synchronize_session=False)
+    )
+    if claimed != len(ids):
+        db.rollback()
+        return
+    apply(db, _walk_counts(walks))
+    db.commit()
+
+
+def remove_walks(db: Session, walk_ids: list):
+    """Deletion hook: take purged walks back out of the heatmap."""
+    walks = db.query(models.Walk).filter(
+        models.Walk.id.in_(walk_ids), models.Walk.in_heatmap == True
+    ).all()
+    if walks:
+        apply(db, _walk_counts(walks), sign=-1)
+
+
+# ---- Reading ----
+
+def get_tile(db: Session, zoom: int, x: int, y: int) -> Optional[models.WalkHeatTile]:
+    T = models.WalkHeatTile
+    return db.query(T).filter(T.zoom == zoom, T.tile_x == x, T.tile_y == y).first()
+
+
+def tile_cells(db: Session, tile: Optional[models.WalkHeatTile]) -> list:
+    """Non-empty cells as [cell, count] pairs, cell = row * CELLS + col."""
+    if tile is None:
+        return []
+    rows = (
+        db.query(models.WalkHeatCell.cell, models.WalkHeatCell.count)
+        .filter(models.WalkHeatCell.tile_id == tile.id, models.WalkHeatCell.count > 0)
+        .order_by(models.WalkHeatCell.cell)
+    )
+    return [[r.cell, r.count] for r in rows]
+
+
+def _color(count: int) -> tuple:
+    """Transparent blue -> yellow -> red ramp on a log scale."""
+    t = min(1.0, math.log1p(count) / math.log1p(SATURATION))
+    if t < 0.5:
+        u = t * 2
+        return (int(255 * u), int(255 * u), int(255 * (1 - u)), int(90 + 110 * u))
+    u = (t - 0.5) * 2
+    return (255, int(255 * (1 - u)), 0, int(200 + 55 * u))
+
+
+def valid_tile(zoom: int, x: int, y: int) -> bool:
+    return MIN_ZOOM <= zoom <= MAX_ZOOM and 0 <= x < (1 << zoom) and 0 <= y < (1 << zoom)
+
+
+@functools.lru_cache(maxsize=1)
+def _blank_png() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0)).save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def _remove_cached(directory: str, y: int):
+    for stale in glob.glob(os.path.join(directory, f"{y}-*.png")):
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+
+def render_png(db: Session, zoom: int, x: int, y: int) -> bytes:
+    """PNG for a tile, served from the disk cache when its version matches.
+
+    Unknown, out-of-range and empty tiles all share one in-memory blank
+    image, so only tiles with data ever reach the disk."""
+    if not valid_tile(zoom, x, y):
+        return _blank_png()
+    tile = get_tile(db, zoom, x, y)
+    if tile is None:
+        return _blank_png()
+    directory = os.path.join(TILE_DIR, str(zoom), str(x))
+    path = os.path.join(directory, f"{y}-{tile.version}.png")
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            return f.read()
+    cells = tile_cells(db, tile)
+    if not cells:
+        # Every walk left the tile: drop PNGs of its older versions
+        _remove_cached(directory, y)
+        return _blank_png()
+
+    image = Image.new("RGBA", (TILE_SIZE, TILE_SIZE), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    size = TILE_SIZE // CELLS
+    for cell, count in cells:
+        row, col = divmod(cell, CELLS)
+        draw.rectangle(
+            [col * size, row * size, (col + 1) * size - 1, (row + 1) * size - 1],
+            fill=_color(count),
+        )
+    image = image.filter(ImageFilter.GaussianBlur(size / 2))
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True)
+    data = buf.getvalue()
+
+    os.makedirs(directory, exist_ok=True)
+    _remove_cached(directory, y)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return data
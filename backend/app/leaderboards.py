@@ -0,0 +1,115 @@
+"""Weekly walk leaderboards.
+
+Each completed walk is added to its walker's entry for the week with an
+atomic increment. Entries of a week are kept ordered by the
+(period_start, city, metric) indexes, so a city board is one index range
+scan and a following board one IN query over the viewer's circle. A new
+week starts from an empty key; old weeks are pruned in the background.
+"""
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import background, models
+from .walk_stats import period_start
+
+KEEP_WEEKS = 8
+PRUNE_EVERY_SECONDS = 6 * 3600
+
+E = models.WalkLeaderboardEntry
+METRICS = {"distance": E.distance_km, "duration": E.duration_minutes}
+
+
+def current_week(now: Optional[date] = None) -> datetime:
+    return period_start("week", now or datetime.utcnow())
+
+
+def record_walk(db: Session, walk: models.Walk, user: models.User):
+    """Add a completed walk to its week; the caller commits."""
+    week = current_week(walk.start_time)
+    if week < current_week() - timedelta(weeks=KEEP_WEEKS):
+        return
+    values = {
+        E.walks: E.walks + 1,
+        E.distance_km: E.distance_km + (walk.distance_km or 0),
+        E.duration_minutes: E.duration_minutes + (walk.duration_minutes or 0),
+        E.updated_at: datetime.utcnow(),
+    }
+    entry = db.query(E).filter(E.period_start == week, E.user_id == user.id)
+    if entry.update(values, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(E(
+                period_start=week, user_id=user.id,
+                city=(user.city or "").strip().lower() or None, walks=1,
+                distance_km=walk.distance_km or 0,
+                duration_minutes=walk.duration_minutes or 0,
+            ))
+    except IntegrityError:
+        # Another request created the entry first
+        entry.update(values, synchronize_session=False)
+
+
+def board(db: Session, viewer: models.User, scope: str, metric: str,
+          week: datetime, limit: int) -> dict:
+    """Top `limit` of the viewer's following circle (and the viewer) or of
+    their city, with the viewer's own rank."""
+    column = METRICS[metric]
+    criteria = [E.period_start == week]
+    if scope == "following":
+        circle = select(models.Follow.followed_id).where(models.Follow.follower_id == viewer.id)
+        criteria.append(or_(E.user_id.in_(circle), E.user_id == viewer.id))
+    else:
+        criteria.append(E.city == (viewer.city or "").strip().lower())
+
+    rows = (
+        db.query(E, models.User.full_name, models.User.avatar_url)
+        .join(models.User, models.User.id == E.user_id)
+        .filter(*criteria, models.User.deleted_at.is_(None))
+        .order_by(column.desc(), E.user_id)
+        .limit(limit)
+        .all()
+    )
+    entries, rank, previous = [], 0, None
+    for i, (entry, full_name, avatar_url) in enumerate(rows, start=1):
+        score = getattr(entry, column.key)
+        if score != previous:
+            rank, previous = i, score
+        entries.append({
+            "rank": rank,
+            "user_id": entry.user_id,
+            "full_name": full_name,
+            "avatar_url": avatar_url,
+            "walks": entry.walks,
+            "distance_km": round(entry.distance_km or 0, 2),
+            "duration_minutes": entry.duration_minutes or 0,
+        })
+
+    mine = db.query(E).filter(*criteria, E.user_id == viewer.id).first()
+    my_rank = None
+    if mine:
+        ahead = (
+            db.query(func.count(E.id))
+            .join(models.User, models.User.id == E.user_id)
+            .filter(*criteria, models.User.deleted_at.is_(None), column > getattr(mine, column.key))
+            .scalar()
+        )
+        my_rank = ahead + 1
+    return {
+        "scope": scope,
+        "metric": metric,
+        "week_start": week.isoformat(),
+        "entries": entries,
+        "my_rank": my_rank,
+    }
+
+
+@background.register("leaderboard_prune", PRUNE_EVERY_SECONDS)
+def prune_old_weeks(db: Session):
+    cutoff = current_week() - timedelta(weeks=KEEP_WEEKS)
+    db.query(E).filter(E.period_start < cutoff).delete(synchronize_session=False)
+    db.commit()
@@ -8,8 +8,8 @@ from .database import engine, Base, SessionLocal
 from .routers import profiles, matching, messaging, plans
 from .routers import health as health_router, walk, food, sitter
 from .routers import social, shop, train, adopt
-from .routers import travel, insure, petid, breed, alert
-from . import models
+from .routers import travel, insure, petid, breed, alert, map as map_router
+from . import models, background
 
 # Create tables
 Base.metadata.create_all(bind=engine)
@@ -45,6 +45,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.on_event("startup")
+def start_background_jobs():
+    background.start()
+
+
+@app.on_event("shutdown")
+def stop_background_jobs():
+    background.stop()
+
+
 # API routes first
 @app.get("/api/healthcheck")
 def healthcheck():
@@ -70,6 +81,7 @@ app.include_router(insure.router)
 app.include_router(petid.router)
 app.include_router(breed.router)
 app.include_router(alert.router)
+app.include_router(map_router.router)
 
 # Use DATA_DIR for persistent storage (Render disk or local)
 DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(__file__), ".."))
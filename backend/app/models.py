@@ -1,5 +1,6 @@
 from sqlalchemy import (
-    Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, Text
+    Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Enum, Text,
+    Index, UniqueConstraint, case, func,
 )
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -47,7 +48,16 @@ class User(Base):
     # Hub order customization: JSON array of hub IDs
     hub_order = Column(Text, nullable=True)  # e.g., '["health","walk","food",...]'
 
+    # Set when account deletion is requested; rows are purged in the background
+    deleted_at = Column(DateTime, nullable=True)
+
     dogs = relationship("Dog", back_populates="owner", cascade="all, delete-orphan")
+    # Dogs not awaiting deletion; use this on every read path
+    active_dogs = relationship(
+        "Dog",
+        primaryjoin="and_(User.id == Dog.owner_id, Dog.deleted_at.is_(None))",
+        viewonly=True,
+    )
 
 
 class Dog(Base):
@@ -112,6 +122,7 @@ class Dog(Base):
     titles = Column(Text, nullable=True)
 
     created_at = Column(DateTime, default=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True)
 
     owner = relationship("User", back_populates="dogs")
     
@@ -180,6 +191,7 @@ class Subscription(Base):
 
 class HealthRecord(Base):
     __tablename__ = "health_records"
+    __table_args__ = (Index("ix_health_records_dog_date", "dog_id", "date"),)
 
     id = Column(Integer, primary_key=True, index=True)
     dog_id = Column(Integer, ForeignKey("dogs.id"), nullable=False)
@@ -195,12 +207,13 @@ class HealthRecord(Base):
 
 class VetVaccination(Base):
     __tablename__ = "vet_vaccinations"
+    __table_args__ = (Index("ix_vet_vaccinations_dog_date", "dog_id", "date"),)
 
     id = Column(Integer, primary_key=True, index=True)
     dog_id = Column(Integer, ForeignKey("dogs.id"), nullable=False)
     name = Column(String, nullable=False)
     date = Column(DateTime, nullable=False)
-    next_due = Column(DateTime, nullable=True)
+    next_due = Column(DateTime, nullable=True, index=True)
     vet_name = Column(String, nullable=True)
     batch_number = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -210,11 +223,12 @@ class VetVaccination(Base):
 
 class VetAppointment(Base):
     __tablename__ = "vet_appointments"
+    __table_args__ = (Index("ix_vet_appointments_dog_date", "dog_id", "date"),)
 
     id = Column(Integer, primary_key=True, index=True)
     dog_id = Column(Integer, ForeignKey("dogs.id"), nullable=False)
     vet_name = Column(String, nullable=False)
-    date = Column(DateTime, nullable=False)
+    date = Column(DateTime, nullable=False, index=True)
     appointment_type = Column(String, nullable=False)  # checkup, vaccination, surgery, grooming
     notes = Column(Text, nullable=True)
     status = Column(String, default="scheduled")  # scheduled, completed, cancelled
@@ -255,14 +269,111 @@ class Walk(Base):
     distance_km = Column(Float, default=0)
     duration_minutes = Column(Integer, default=0)
     calories = Column(Integer, default=0)
-    route_json = Column(Text, nullable=True)  # JSON array of {lat, lng}
+    route_json = Column(Text, nullable=True)  # Legacy: JSON array of {lat, lng}
+    route_polyline = Column(Text, nullable=True)  # Encoded polyline (see app/polyline.py)
+    route_events_json = Column(Text, nullable=True)  # JSON array of {type, lat, lng, time}
     notes = Column(Text, nullable=True)
+    status = Column(String, default="completed")  # live, completed
+    in_heatmap = Column(Boolean, default=False, index=True)  # counted in walk_heat_cells
     created_at = Column(DateTime, default=datetime.utcnow)
 
     dog = relationship("Dog")
     user = relationship("User")
 
 
+class WalkRouteLevel(Base):
+    """Coarser copy of a walk route, used for map zooms below `max_zoom`."""
+    __tablename__ = "walk_route_levels"
+
+    id = Column(Integer, primary_key=True, index=True)
+    walk_id = Column(Integer, ForeignKey("walks.id"), nullable=False, index=True)
+    max_zoom = Column(Integer, nullable=False)
+    tolerance_m = Column(Float, nullable=False)
+    route_polyline = Column(Text, nullable=False)
+
+    walk = relationship("Walk")
+
+
+class WalkTrackState(Base):
+    """Tail of a live walk's track, so point batches can be appended without
+    re-reading the route."""
+    __tablename__ = "walk_track_states"
+
+    id = Column(Integer, primary_key=True, index=True)
+    walk_id = Column(Integer, ForeignKey("walks.id"), nullable=False, unique=True)
+    last_lat = Column(Float, nullable=True)
+    last_lng = Column(Float, nullable=True)
+    last_time = Column(DateTime, nullable=True)
+    point_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    walk = relationship("Walk")
+
+
+class WalkStatsRollup(Base):
+    """Per-dog walk totals for one day/week/month bucket, or for all time."""
+    __tablename__ = "walk_stats_rollups"
+    __table_args__ = (UniqueConstraint("dog_id", "period", "period_start"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    dog_id = Column(Integer, ForeignKey("dogs.id"), nullable=False)
+    period = Column(String, nullable=False)  # day, week, month, all
+    period_start = Column(DateTime, nullable=False)
+    walks = Column(Integer, default=0)
+    distance_km = Column(Float, default=0)
+    duration_minutes = Column(Integer, default=0)
+    calories = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    dog = relationship("Dog")
+
+
+class WalkLeaderboardEntry(Base):
+    """A user's walk totals for one leaderboard week (starting Monday)."""
+    __tablename__ = "walk_leaderboard_entries"
+    __table_args__ = (
+        UniqueConstraint("period_start", "user_id"),
+        Index("ix_walk_leaderboard_city_distance", "period_start", "city", "distance_km"),
+        Index("ix_walk_leaderboard_city_duration", "period_start", "city", "duration_minutes"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    period_start = Column(DateTime, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    city = Column(String, nullable=True)  # lowercased, as of the user's first walk that week
+    walks = Column(Integer, default=0)
+    distance_km = Column(Float, default=0)
+    duration_minutes = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    user = relationship("User")
+
+
+class WalkHeatTile(Base):
+    """A slippy-map tile (z/x/y) of the walk heatmap; `version` changes with its cells."""
+    __tablename__ = "walk_heat_tiles"
+    __table_args__ = (UniqueConstraint("zoom", "tile_x", "tile_y"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    zoom = Column(Integer, nullable=False)
+    tile_x = Column(Integer, nullable=False)
+    tile_y = Column(Integer, nullable=False)
+    version = Column(Integer, default=0)
+    max_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class WalkHeatCell(Base):
+    """Number of walks crossing one cell of a heatmap tile (row-major index)."""
+    __tablename__ = "walk_heat_cells"
+    __table_args__ = (UniqueConstraint("tile_id", "cell"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    tile_id = Column(Integer, ForeignKey("walk_heat_tiles.id"), nullable=False)
+    cell = Column(Integer, nullable=False)
+    count = Column(Integer, default=0)
+
+
 class WalkSpot(Base):
     __tablename__ = "walk_spots"
 
@@ -343,10 +454,51 @@ class Meal(Base):
     dog = relationship("Dog")
     food_product = relationship("FoodProduct")
 
+
+class NutritionDailyRollup(Base):
+    """Per-dog nutrition totals for one day, or for all time (day 1970-01-01)."""
+    __tablename__ = "nutrition_daily_rollups"
+    __table_args__ = (UniqueConstraint("dog_id", "day"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    dog_id = Column(Integer, ForeignKey("dogs.id"), nullable=False)
+    day = Column(DateTime, nullable=False)
+    meals = Column(Integer, default=0)
+    kcal = Column(Integer, default=0)
+    grams = Column(Float, default=0)
+    protein_g = Column(Float, default=0)
+    fat_g = Column(Float, default=0)
+    fiber_g = Column(Float, default=0)
+    last_meal_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    dog = relationship("Dog")
+
 # ============================================================
 # WoofSitter - Garde & Pet-sitting
 # ============================================================
 
+# Bayesian smoothing of sitter ratings: every sitter starts with
+# SITTER_PRIOR_REVIEWS virtual reviews at SITTER_PRIOR_RATING
+SITTER_PRIOR_RATING = 4.0
+SITTER_PRIOR_REVIEWS = 5
+
+
+def sitter_ranking_score(rating_sum, total_reviews):
+    """Works on numbers and on SQL expressions alike."""
+    return (SITTER_PRIOR_RATING * SITTER_PRIOR_REVIEWS + rating_sum) / (SITTER_PRIOR_REVIEWS + total_reviews)
+
+
+def _initial_rating_sum(context):
+    params = context.get_current_parameters()
+    return (params.get("rating") or 0) * (params.get("total_reviews") or 0)
+
+
+def _initial_ranking_score(context):
+    params = context.get_current_parameters()
+    return sitter_ranking_score(_initial_rating_sum(context), params.get("total_reviews") or 0)
+
+
 class SitterProfile(Base):
     __tablename__ = "sitter_profiles"
 
@@ -362,14 +514,34 @@ class SitterProfile(Base):
     verified = Column(Boolean, default=False)
     rating = Column(Float, default=0)
     total_reviews = Column(Integer, default=0)
+    rating_sum = Column(Float, default=_initial_rating_sum)
+    ranking_score = Column(Float, default=_initial_ranking_score, index=True)
+    # Bumped before each capacity check so concurrent bookings serialise
+    bookings_version = Column(Integer, default=0)
     photo_url = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
 
 
+def sitter_rating_update(rating_delta, reviews_delta) -> dict:
+    """SET values folding `reviews_delta` reviews worth `rating_delta` into a
+    sitter's sum and count; they read the row's current values, so
+    concurrent updates add up."""
+    S = SitterProfile
+    rating_sum = func.coalesce(S.rating_sum, 0) + rating_delta
+    total_reviews = func.coalesce(S.total_reviews, 0) + reviews_delta
+    return {
+        S.rating_sum: rating_sum,
+        S.total_reviews: total_reviews,
+        S.rating: case((total_reviews > 0, func.round(rating_sum * 1.0 / total_reviews, 2)), else_=0),
+        S.ranking_score: sitter_ranking_score(rating_sum, total_reviews),
+    }
+
+
 class SitterBooking(Base):
     __tablename__ = "sitter_bookings"
+    __table_args__ = (Index("ix_sitter_bookings_sitter_dates", "sitter_id", "start_date", "end_date"),)
 
     id = Column(Integer, primary_key=True, index=True)
     sitter_id = Column(Integer, ForeignKey("sitter_profiles.id"), nullable=False)
@@ -419,6 +591,7 @@ class Post(Base):
     likes_count = Column(Integer, default=0)
     comments_count = Column(Integer, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True)
 
     user = relationship("User")
     dog = relationship("Dog")
@@ -430,7 +603,7 @@ class PostLike(Base):
     id = Column(Integer, primary_key=True, index=True)
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     post = relationship("Post")
     user = relationship("User")
@@ -443,7 +616,7 @@ class PostComment(Base):
     post_id = Column(Integer, ForeignKey("posts.id"), nullable=False)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     content = Column(Text, nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     post = relationship("Post")
     user = relationship("User")
@@ -475,10 +648,13 @@ class Product(Base):
     category = Column(String, nullable=False)  # toys, accessories, clothing, grooming, beds, bowls
     image_url = Column(String, nullable=True)
     stock = Column(Integer, default=0)
+    reserved = Column(Integer, default=0)  # units held by carts, see reservations.py
     rating = Column(Float, default=0)
     brand = Column(String, nullable=True)
     is_featured = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Bumped by catalog edits only, not stock moves; see product_search.py
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 
 class CartItem(Base):
@@ -488,6 +664,8 @@ class CartItem(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
     quantity = Column(Integer, default=1)
+    reserved_qty = Column(Integer, default=0)
+    reserved_until = Column(DateTime, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
@@ -496,6 +674,7 @@ class CartItem(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (Index("ix_orders_user_created", "user_id", "created_at"),)
 
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -520,6 +699,22 @@ class OrderItem(Base):
     product = relationship("Product")
 
 
+class ProductRecommendation(Base):
+    """Products often bought with `product_id`, rebuilt offline from orders."""
+    __tablename__ = "product_recommendations"
+    __table_args__ = (
+        UniqueConstraint("product_id", "related_product_id"),
+        Index("ix_product_recommendations_rank", "product_id", "rank"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    related_product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    rank = Column(Integer, nullable=False)
+    score = Column(Float, nullable=False)
+    orders = Column(Integer, nullable=False)  # orders containing both products
+
+
 # ============================================================
 # WoofTrain - Education & Dressage
 # ============================================================
@@ -535,6 +730,7 @@ class TrainingProgram(Base):
     duration_weeks = Column(Integer, default=4)
     image_url = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
 class TrainingStep(Base):
@@ -548,6 +744,7 @@ class TrainingStep(Base):
     tips = Column(Text, nullable=True)
     duration_minutes = Column(Integer, default=15)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     program = relationship("TrainingProgram")
 
@@ -843,3 +1040,51 @@ class DangerZone(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User")
+
+
+# ============================================================
+# Maintenance - Suppressions differees
+# ============================================================
+
+class DeletionJob(Base):
+    __tablename__ = "deletion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity_type = Column(String, nullable=False)  # post, dog, user
+    entity_id = Column(Integer, nullable=False)
+    step = Column(Integer, default=0)  # index of the next purge step
+    status = Column(String, default="pending", index=True)  # pending, done
+    # Lease of the worker purging the job; others skip it until it lapses
+    claimed_by = Column(String, nullable=True)
+    claimed_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class SchedulerWatermark(Base):
+    """How far a periodic scan has got, as a (timestamp, id) keyset position."""
+    __tablename__ = "scheduler_watermarks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, nullable=False)
+    position_at = Column(DateTime, nullable=False)
+    position_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+class NotificationOutbox(Base):
+    """A notification queued for delivery; (kind, ref_id) makes enqueueing idempotent."""
+    __tablename__ = "notification_outbox"
+    __table_args__ = (UniqueConstraint("kind", "ref_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    dog_id = Column(Integer, ForeignKey("dogs.id"), nullable=True)
+    kind = Column(String, nullable=False)  # vaccination_due, appointment
+    ref_id = Column(Integer, nullable=False)
+    title = Column(String, nullable=False)
+    body = Column(Text, nullable=True)
+    due_at = Column(DateTime, nullable=False)
+    status = Column(String, default="pending", index=True)  # pending, sent
+    created_at = Column(DateTime, default=datetime.utcnow)
+    sent_at = Column(DateTime, nullable=True)
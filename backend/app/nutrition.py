@@ -0,0 +1,113 @@
+"""Daily nutrition rollups.
+
+Each logged meal is added to its dog's day and all-time rows with atomic
+increments: kcal, grams, meal count, and protein/fat/fiber grams derived
+from the product's percentages. Today's stats and trends over weeks read
+these rows instead of scanning `meals`. Dogs whose meals predate the
+rollups are backfilled once, on first use.
+"""
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable, Optional, Tuple
+
+from sqlalchemy import case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+ALL_TIME = datetime(1970, 1, 1)
+
+R = models.NutritionDailyRollup
+_FIELDS = ("meals", "kcal", "grams", "protein_g", "fat_g", "fiber_g")
+
+
+def day_of(ts: datetime) -> datetime:
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def meal_totals(amount_g: float, calories: int, food: Optional[models.FoodProduct]) -> dict:
+    def macro(pct):
+        return amount_g * pct / 100 if pct else 0.0
+
+    return {
+        "meals": 1,
+        "kcal": calories or 0,
+        "grams": amount_g or 0,
+        "protein_g": macro(food.protein_pct) if food else 0.0,
+        "fat_g": macro(food.fat_pct) if food else 0.0,
+        "fiber_g": macro(food.fiber_pct) if food else 0.0,
+    }
+
+
+def _buckets():
+    # day -> [totals, last meal time]
+    return defaultdict(lambda: [dict.fromkeys(_FIELDS, 0), None])
+
+
+def _accumulate(days, meal: models.Meal, food: Optional[models.FoodProduct]):
+    totals = meal_totals(meal.amount_g, meal.calories, food)
+    for key in (day_of(meal.timestamp), ALL_TIME):
+        bucket = days[key]
+        for f, v in totals.items():
+            bucket[0][f] += v
+        if bucket[1] is None or meal.timestamp > bucket[1]:
+            bucket[1] = meal.timestamp
+
+
+def _increment(db: Session, dog_id: int, day: datetime, totals: dict, last_at: datetime):
+    values = {getattr(R, f): getattr(R, f) + totals[f] for f in _FIELDS}
+    values[R.last_meal_at] = case(
+        (R.last_meal_at.is_(None) | (R.last_meal_at < last_at), last_at),
+        else_=R.last_meal_at,
+    )
+    values[R.updated_at] = datetime.utcnow()
+    row = db.query(R).filter(R.dog_id == dog_id, R.day == day)
+    if row.update(values, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(R(dog_id=dog_id, day=day, last_meal_at=last_at, **totals))
+    except IntegrityError:
+        # Another request created the row first
+        row.update(values, synchronize_session=False)
+
+
+def record_meals(db: Session, dog_id: int, meals: Iterable[Tuple[models.Meal, Optional[models.FoodProduct]]]):
+    """Add logged meals of one dog to its rollups, one increment per day
+    touched; the caller commits."""
+    db.flush()
+    if not ensure_rollups(db, dog_id):
+        return
+    days = _buckets()
+    for meal, food in meals:
+        _accumulate(days, meal, food)
+    for day, (totals, last_at) in days.items():
+        _increment(db, dog_id, day, totals, last_at)
+
+
+def ensure_rollups(db: Session, dog_id: int) -> bool:
+    """Backfill a dog's rollups from its meals if they were never built.
+
+    Returns False when a backfill ran (it already covers every meal)."""
+    built = db.query(R.id).filter(R.dog_id == dog_id, R.day == ALL_TIME).first()
+    if built:
+        return True
+    rebuild(db, dog_id)
+    return False
+
+
+def rebuild(db: Session, dog_id: int):
+    db.query(R).filter(R.dog_id == dog_id).delete(synchronize_session=False)
+    days = _buckets()
+    days[ALL_TIME]  # always written, even with no meals, marks the dog as built
+    rows = (
+        db.query(models.Meal, models.FoodProduct)
+        .outerjoin(models.FoodProduct, models.FoodProduct.id == models.Meal.food_product_id)
+        .filter(models.Meal.dog_id == dog_id)
+    )
+    for meal, food in rows:
+        _accumulate(days, meal, food)
+    for day, (totals, last_at) in days.items():
+        db.add(R(dog_id=dog_id, day=day, last_meal_at=last_at, **totals))
+    db.flush()
@@ -0,0 +1,199 @@
+"""Full-text product search with facets.
+
+The catalog is held in memory as an inverted index: accent-folded tokens of
+name, brand, category and description map to the products containing them,
+with a per-field weight for relevance. A query keeps products matching
+every term (the last one as a prefix, for search-as-you-type), then one
+pass over the matches applies the filters and counts the category, price
+and rating facets. Each facet counts the products passing every *other*
+filter, so selecting a category still shows the counts of its siblings.
+
+Results are cached per normalised query in a small LRU keyed by the index
+version. The index is rebuilt, and the cache thereby dropped, when the
+catalog fingerprint (product count, last id, price and rating totals,
+latest `updated_at`) changes; it is re-read at most every
+FINGERPRINT_SECONDS. Stock updates leave `updated_at` alone, so carts do
+not churn the index; whatever edits a name, description, brand or
+category sets it, and in-process writers also call `invalidate()`.
+"""
+import bisect
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+FINGERPRINT_SECONDS = 30
+CACHE_SIZE = 512
+FIELD_WEIGHTS = {"name": 3.0, "brand": 2.0, "category": 2.0, "description": 1.0}
+
+# (key, low, high): low <= value < high
+PRICE_BUCKETS = [
+    ("0-10", 0, 10), ("10-25", 10, 25), ("25-50", 25, 50),
+    ("50-100", 50, 100), ("100+", 100, None),
+]
+RATING_BANDS = [("4+", 4, None), ("3-4", 3, 4), ("0-3", 0, 3)]
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokens(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode().lower()
+    return _TOKEN.findall(folded)
+
+
+def _bucket(value: Optional[float], buckets) -> Optional[str]:
+    if value is None:
+        return None
+    for key, low, high in buckets:
+        if value >= low and (high is None or value < high):
+            return key
+    return None
+
+
+class CatalogIndex:
+    def __init__(self, products: List[models.Product]):
+        self.docs = {}  # id -> (category, price, rating, created_at)
+        self.postings = defaultdict(dict)  # token -> {id: weight}
+        for p in products:
+            self.docs[p.id] = (p.category, p.price, p.rating or 0, p.created_at)
+            for field, weight in FIELD_WEIGHTS.items():
+                for token in tokens(getattr(p, field)):
+                    scores = self.postings[token]
+                    scores[p.id] = scores.get(p.id, 0) + weight
+        self.vocabulary = sorted(self.postings)
+        self.categories = sorted({d[0] for d in self.docs.values() if d[0]})
+
+    def _term(self, token: str, prefix: bool) -> Dict[int, float]:
+        if not prefix:
+            return self.postings.get(token, {})
+        merged = {}
+        i = bisect.bisect_left(self.vocabulary, token)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(token):
+            for id, w in self.postings[self.vocabulary[i]].items():
+                merged[id] = max(merged.get(id, 0), w)
+            i += 1
+        return merged
+
+    def match(self, terms: List[str]) -> Dict[int, float]:
+        """Products containing every term, with their relevance."""
+        if not terms:
+            return {id: 0.0 for id in self.docs}
+        lists = [self._term(t, prefix=(i == len(terms) - 1)) for i, t in enumerate(terms)]
+        lists.sort(key=len)
+        scores = dict(lists[0])
+        for other in lists[1:]:
+            scores = {id: s + other[id] for id, s in scores.items() if id in other}
+            if not scores:
+                break
+        return scores
+
+    def search(self, terms: List[str], category: Optional[str], min_price: Optional[float],
+               max_price: Optional[float], min_rating: Optional[float], sort_by: Optional[str]):
+        """(ordered product ids, facets) for a query."""
+        facets = {
+            "category": defaultdict(int),
+            "price": dict.fromkeys((b[0] for b in PRICE_BUCKETS), 0),
+            "rating": dict.fromkeys((b[0] for b in RATING_BANDS), 0),
+        }
+        hits = []
+        for id, score in self.match(terms).items():
+            cat, price, rating, created_at = self.docs[id]
+            failed = []
+            if category and cat != category:
+                failed.append("category")
+            if (min_price is not None and price < min_price) or (max_price is not None and price > max_price):
+                failed.append("price")
+            if min_rating is not None and rating < min_rating:
+                failed.append("rating")
+            if len(failed) > 1:
+                continue
+            if not failed:
+                hits.append((id, score, price, rating, created_at))
+            values = {
+                "category": cat,
+                "price": _bucket(price, PRICE_BUCKETS),
+                "rating": _bucket(rating, RATING_BANDS),
+            }
+            for facet in (failed or facets):
+                if values[facet] is not None:
+                    facets[facet][values[facet]] += 1
+
+        if sort_by == "price_asc":
+            hits.sort(key=lambda h: (h[2], h[0]))
+        elif sort_by == "price_desc":
+            hits.sort(key=lambda h: (-h[2], h[0]))
+        elif sort_by == "rating":
+            hits.sort(key=lambda h: (-h[3], h[0]))
+        elif sort_by == "newest" or not terms:
+            hits.sort(key=lambda h: (h[4] is not None, h[4], h[0]), reverse=True)
+        else:
+            hits.sort(key=lambda h: (-h[1], -h[3], h[0]))
+        facets["category"] = dict(sorted(facets["category"].items()))
+        return [h[0] for h in hits], facets
+
+
+class ProductSearch:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._cache = OrderedDict()
+        self.version = 0
+
+    def invalidate(self):
+        """Rebuild on next use, e.g. after an in-process product edit."""
+        with self._lock:
+            self._checked_at = 0.0
+            self._fingerprint = None
+
+    def index(self, db: Session) -> CatalogIndex:
+        return self._current(db)[0]
+
+    def _current(self, db: Session) -> Tuple[CatalogIndex, int]:
+        with self._lock:
+            if self._index is not None and time.monotonic() - self._checked_at < FINGERPRINT_SECONDS:
+                return self._index, self.version
+            P = models.Product
+            fingerprint = tuple(
+                db.query(
+                    func.count(P.id), func.max(P.id), func.sum(P.price), func.sum(P.rating),
+                    func.max(P.updated_at),
+                ).one()
+            )
+            if self._index is None or fingerprint != self._fingerprint:
+                self._index = CatalogIndex(db.query(P).all())
+                self._fingerprint = fingerprint
+                self._cache.clear()
+                self.version += 1
+            self._checked_at = time.monotonic()
+            return self._index, self.version
+
+    def search(self, db: Session, q: Optional[str], category: Optional[str] = None,
+               min_price: Optional[float] = None, max_price: Optional[float] = None,
+               min_rating: Optional[float] = None, sort_by: Optional[str] = None) -> Tuple[List[int], dict]:
+        index, version = self._current(db)
+        terms = tokens(q)
+        key = (version, " ".join(terms), category, min_price, max_price, min_rating, sort_by)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        result = index.search(terms, category, min_price, max_price, min_rating, sort_by)
+        with self._lock:
+            self._cache[key] = result
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return result
+
+
+catalog = ProductSearch()
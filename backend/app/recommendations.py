@@ -0,0 +1,170 @@
+"""Frequently-bought-together product recommendations.
+
+A background job streams order items in order-id order, turns each order
+into a basket of distinct products and counts, for every pair of products
+in a basket, how many orders contain both: a sparse item-item
+co-occurrence matrix held as a dict of Counters. Each product's neighbours
+are scored by cosine similarity, shared / sqrt(orders(a) * orders(b)), so
+best-sellers do not top every list, and the TOP_N best replace that
+product's ProductRecommendation rows. Serving is then one indexed lookup
+per product, cached in process for CACHE_SECONDS.
+
+The job only rebuilds when order items were added since the last build,
+recorded as a SchedulerWatermark; workers claim a rebuild by moving the
+watermark with a compare-and-set.
+"""
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from itertools import combinations
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import background, models
+
+TOP_N = 10
+# Baskets larger than this are bulk orders, not a signal of affinity
+MAX_BASKET = 50
+STREAM_BATCH = 5000
+RUN_EVERY_SECONDS = 3600
+CACHE_SECONDS = 300
+
+R = models.ProductRecommendation
+WATERMARK = "recommendations"
+
+
+def co_occurrence(db: Session) -> Tuple[Dict[int, Counter], Counter]:
+    """(pair counts {a: {b: orders with both}}, orders per product)."""
+    pairs = defaultdict(Counter)
+    orders = Counter()
+
+    def flush(basket):
+        if len(basket) > MAX_BASKET:
+            return
+        orders.update(basket)
+        for a, b in combinations(sorted(basket), 2):
+            pairs[a][b] += 1
+            pairs[b][a] += 1
+
+    rows = (
+        db.query(models.OrderItem.order_id, models.OrderItem.product_id)
+        .order_by(models.OrderItem.order_id)
+        .yield_per(STREAM_BATCH)
+    )
+    current, basket = None, set()
+    for order_id, product_id in rows:
+        if order_id != current:
+            flush(basket)
+            current, basket = order_id, set()
+        basket.add(product_id)
+    flush(basket)
+    return pairs, orders
+
+
+def top_neighbours(pairs: Dict[int, Counter], orders: Counter, n: int = TOP_N) -> Dict[int, List[tuple]]:
+    """{product: [(related, score, shared orders)]}, best first."""
+    result = {}
+    for a, related in pairs.items():
+        scored = [
+            (b, shared / math.sqrt(orders[a] * orders[b]), shared)
+            for b, shared in related.items()
+        ]
+        scored.sort(key=lambda r: (-r[1], -r[2], r[0]))
+        result[a] = scored[:n]
+    return result
+
+
+def rebuild(db: Session):
+    """Recompute every product's recommendations; the caller commits."""
+    neighbours = top_neighbours(*co_occurrence(db))
+    db.query(R).delete(synchronize_session=False)
+    db.add_all([
+        R(product_id=a, related_product_id=b, rank=rank, score=round(score, 6), orders=shared)
+        for a, related in neighbours.items()
+        for rank, (b, score, shared) in enumerate(related, start=1)
+    ])
+
+
+@background.register("recommendations", RUN_EVERY_SECONDS)
+def refresh(db: Session):
+    W = models.SchedulerWatermark
+    latest = db.query(func.max(models.OrderItem.id)).scalar() or 0
+    mark = db.query(W).filter(W.name == WATERMARK).first()
+    if mark is None:
+        try:
+            with db.begin_nested():
+                db.add(W(name=WATERMARK, position_at=datetime.utcnow(), position_id=-1))
+        except IntegrityError:
+            pass
+        db.commit()
+        mark = db.query(W).filter(W.name == WATERMARK).first()
+    if mark.position_id == latest:
+        return
+    claimed = (
+        db.query(W)
+        .filter(W.id == mark.id, W.position_id == mark.position_id)
+        .update({W.position_id: latest, W.position_at: datetime.utcnow()}, synchronize_session=False)
+    )
+    if not claimed:
+        db.rollback()
+        return
+    rebuild(db)
+    db.commit()
+    cache.clear()
+
+
+class _Cache:
+    """Recommended product ids per product, kept CACHE_SECONDS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def related(self, db: Session, product_ids: List[int]) -> Dict[int, List[Tuple[int, float]]]:
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for pid in product_ids:
+                entry = self._entries.get(pid)
+                if entry and now - entry[0] < CACHE_SECONDS:
+                    found[pid] = entry[1]
+                else:
+                    missing.append(pid)
+        if missing:
+            loaded = defaultdict(list)
+            rows = (
+                db.query(R.product_id, R.related_product_id, R.score)
+                .filter(R.product_id.in_(missing))
+                .order_by(R.product_id, R.rank)
+            )
+            for pid, related, score in rows:
+                loaded[pid].append((related, score))
+            with self._lock:
+                for pid in missing:
+                    found[pid] = loaded.get(pid, [])
+                    self._entries[pid] = (now, found[pid])
+        return found
+
+
+cache = _Cache()
+
+
+def for_products(db: Session, product_ids: List[int], limit: int) -> List[int]:
+    """Products bought with any of `product_ids`, excluding them, best
+    summed score first."""
+    scores = Counter()
+    for related in cache.related(db, product_ids).values():
+        for pid, score in related:
+            scores[pid] += score
+    for pid in product_ids:
+        scores.pop(pid, None)
+    return [pid for pid, _ in sorted(scores.items(), key=lambda s: (-s[1], s[0]))[:limit]]
@@ -0,0 +1,141 @@
+"""Vaccination and vet appointment reminders.
+
+A background job walks each source in (due date, id) order through the
+`next_due` / `date` indexes, from a stored watermark up to `now + lead`, in
+batches of BATCH_SIZE, and queues one NotificationOutbox row per item. The
+watermark only moves forward, so no run rescans past items. Items created
+already inside their reminder window are queued at creation instead, since
+the watermark may have passed their due date.
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import background, models
+
+BATCH_SIZE = 200
+BATCHES_PER_RUN = 10
+RUN_EVERY_SECONDS = 60
+# Items already overdue by more than this when first seen are not reminded
+GRACE = timedelta(days=1)
+
+
+def _vaccination_message(item, dog_name):
+    return f"Rappel vaccin {item.name} pour {dog_name}", f"A faire avant le {item.next_due:%d/%m/%Y}"
+
+
+def _appointment_message(item, dog_name):
+    return (
+        f"Rendez-vous veterinaire pour {dog_name}",
+        f"{item.appointment_type} avec {item.vet_name} le {item.date:%d/%m/%Y a %H:%M}",
+    )
+
+
+# kind -> (model, due column, lead time, message builder, still relevant?)
+SOURCES = {
+    "vaccination_due": (
+        models.VetVaccination, models.VetVaccination.next_due, timedelta(days=7),
+        _vaccination_message, lambda item: True,
+    ),
+    "appointment": (
+        models.VetAppointment, models.VetAppointment.date, timedelta(days=1),
+        _appointment_message, lambda item: item.status in (None, "scheduled"),
+    ),
+}
+
+
+def _outbox_row(kind, item, dog) -> models.NotificationOutbox:
+    model, due_col, lead, message, _ = SOURCES[kind]
+    title, body = message(item, dog.name)
+    return models.NotificationOutbox(
+        user_id=dog.owner_id, dog_id=dog.id, kind=kind, ref_id=item.id,
+        title=title, body=body, due_at=getattr(item, due_col.key),
+    )
+
+
+def _scan_batch(db: Session, kind: str, now: datetime) -> int:
+    """Queue reminders for the next batch of `kind`; returns rows scanned."""
+    model, due_col, lead, _, relevant = SOURCES[kind]
+    W = models.SchedulerWatermark
+    mark = db.query(W).filter(W.name == kind).first()
+    if mark is None:
+        try:
+            with db.begin_nested():
+                db.add(W(name=kind, position_at=now - GRACE, position_id=0))
+        except IntegrityError:
+            pass
+        db.commit()
+        mark = db.query(W).filter(W.name == kind).first()
+
+    rows = (
+        db.query(model, models.Dog)
+        .join(models.Dog, models.Dog.id == model.dog_id)
+        .filter(
+            or_(
+                due_col > mark.position_at,
+                and_(due_col == mark.position_at, model.id > mark.position_id),
+            ),
+            due_col <= now + lead,
+        )
+        .order_by(due_col, model.id)
+        .limit(BATCH_SIZE)
+        .all()
+    )
+    if not rows:
+        return 0
+
+    last = rows[-1][0]
+    # Move the watermark first; a worker that loses the race backs off
+    claimed = (
+        db.query(W)
+        .filter(W.id == mark.id, W.position_at == mark.position_at, W.position_id == mark.position_id)
+        .update(
+            {W.position_at: getattr(last, due_col.key), W.position_id: last.id, W.updated_at: now},
+            synchronize_session=False,
+        )
+    )
+    if not claimed:
+        db.rollback()
+        return 0
+
+    queued = {
+        r.ref_id for r in db.query(models.NotificationOutbox.ref_id).filter(
+            models.NotificationOutbox.kind == kind,
+            models.NotificationOutbox.ref_id.in_([item.id for item, _ in rows]),
+        )
+    }
+    for item, dog in rows:
+        if item.id not in queued and dog.deleted_at is None and relevant(item):
+            db.add(_outbox_row(kind, item, dog))
+    db.commit()
+    return len(rows)
+
+
+@background.register("reminders", RUN_EVERY_SECONDS)
+def scan_due_items(db: Session):
+    now = datetime.utcnow()
+    for kind in SOURCES:
+        for _ in range(BATCHES_PER_RUN):
+            if _scan_batch(db, kind, now) < BATCH_SIZE:
+                break
+
+
+def queue_if_due(db: Session, kind: str, item):
+    """Queue a reminder for a new item already inside its reminder window.
+    Flushes the session; the caller commits."""
+    model, due_col, lead, _, relevant = SOURCES[kind]
+    due = getattr(item, due_col.key)
+    if due is not None and due.tzinfo is not None:
+        due = due.astimezone(timezone.utc).replace(tzinfo=None)
+    now = datetime.utcnow()
+    if due is None or not (now - GRACE <= due <= now + lead) or not relevant(item):
+        return
+    db.flush()
+    try:
+        with db.begin_nested():
+            db.add(_outbox_row(kind, item, item.dog))
+    except IntegrityError:
+        # The scheduler got there first
+        pass
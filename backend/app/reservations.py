@@ -0,0 +1,106 @@
+"""Short-lived stock reservations for cart items.
+
+Adding to or resizing a cart item holds its quantity for HOLD_MINUTES:
+`Product.reserved` counts held units, and a unit can only be held while
+`stock - reserved` covers it, so shoppers learn a product is gone when they
+add it, not at checkout. Each cart item remembers what it holds
+(`reserved_qty`) and until when (`reserved_until`, indexed). A background
+job walks expired holds through that index in batches and gives the units
+back; the cart item itself stays, unreserved.
+"""
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import case
+from sqlalchemy.orm import Session
+
+from . import background, models
+
+HOLD_MINUTES = int(os.getenv("CART_HOLD_MINUTES", "15"))
+BATCH_SIZE = 200
+BATCHES_PER_RUN = 10
+RUN_EVERY_SECONDS = 60
+
+P = models.Product
+C = models.CartItem
+
+
+def available(product: models.Product) -> int:
+    return max((product.stock or 0) - (product.reserved or 0), 0)
+
+
+def reserve(db: Session, product_id: int, quantity: int) -> bool:
+    """Hold `quantity` more units if that many are free; the caller commits."""
+    return bool(
+        db.query(P)
+        .filter(P.id == product_id, P.stock - P.reserved >= quantity)
+        .update({P.reserved: P.reserved + quantity}, synchronize_session=False)
+    )
+
+
+def release(db: Session, quantities: Dict[int, int]):
+    """Give back {product_id: units}, never below zero; the caller commits."""
+    quantities = {pid: q for pid, q in quantities.items() if q}
+    if not quantities:
+        return
+    qty = case(quantities, value=P.id)
+    db.query(P).filter(P.id.in_(list(quantities))).update(
+        {P.reserved: case((P.reserved > qty, P.reserved - qty), else_=0)},
+        synchronize_session=False,
+    )
+
+
+def hold(db: Session, item: models.CartItem, quantity: int) -> bool:
+    """Make `item` hold `quantity` units, reserving or releasing the
+    difference, and restart its timer. False if the units are not free."""
+    delta = quantity - (item.reserved_qty or 0)
+    if delta > 0 and not reserve(db, item.product_id, delta):
+        return False
+    if delta < 0:
+        release(db, {item.product_id: -delta})
+    item.reserved_qty = quantity
+    item.reserved_until = datetime.utcnow() + timedelta(minutes=HOLD_MINUTES)
+    return True
+
+
+def release_items(db: Session, ids: list):
+    """Give back what the cart items `ids` hold, before they are deleted."""
+    held = Counter()
+    rows = db.query(C.product_id, C.reserved_qty).filter(C.id.in_(ids), C.reserved_qty > 0)
+    for product_id, quantity in rows:
+        held[product_id] += quantity
+    release(db, held)
+
+
+def _expire_batch(db: Session, now: datetime) -> int:
+    rows = (
+        db.query(C.id, C.product_id, C.reserved_qty, C.reserved_until)
+        .filter(C.reserved_until <= now)
+        .order_by(C.reserved_until)
+        .limit(BATCH_SIZE)
+        .all()
+    )
+    freed = Counter()
+    for id, product_id, quantity, until in rows:
+        # Only release what is still held as read: a checkout or cart
+        # update may have changed the item since
+        claimed = (
+            db.query(C)
+            .filter(C.id == id, C.reserved_qty == quantity, C.reserved_until == until)
+            .update({C.reserved_qty: 0, C.reserved_until: None}, synchronize_session=False)
+        )
+        if claimed:
+            freed[product_id] += quantity or 0
+    release(db, freed)
+    db.commit()
+    return len(rows)
+
+
+@background.register("cart_reservations", RUN_EVERY_SECONDS)
+def expire_holds(db: Session):
+    now = datetime.utcnow()
+    for _ in range(BATCHES_PER_RUN):
+        if _expire_batch(db, now) < BATCH_SIZE:
+            break
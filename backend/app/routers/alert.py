@@ -5,7 +5,7 @@ from typing import Optional, List
 from datetime import datetime
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import models, clustering
 
 router = APIRouter(prefix="/api/alerts", tags=["WoofAlert"])
 
@@ -35,6 +35,8 @@ def create_danger_zone(
     db.add(zone)
     db.commit()
     db.refresh(zone)
+    clustering.LAYERS["danger"].add(zone.id, zone.latitude, zone.longitude,
+                                    {"name": None, "type": zone.alert_type})
     return zone
 
 @router.get("/danger")
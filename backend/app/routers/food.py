@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import case
 from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import Optional, List
 from datetime import datetime, date, timedelta
-from sqlalchemy import func
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import models, nutrition
+from ..availability import as_utc
 
 router = APIRouter(prefix="/api/food", tags=["WoofFood"])
 
@@ -24,6 +25,7 @@ class FoodProductCreate(BaseModel):
     low_stock_threshold_g: Optional[float] = 500
     protein_pct: Optional[float] = None
     fat_pct: Optional[float] = None
+    fiber_pct: Optional[float] = None
 
 
 class FoodRefill(BaseModel):
@@ -37,6 +39,16 @@ class MealLogCreate(BaseModel):
     timestamp: Optional[datetime] = None
     meal_type: str = "meal"  # meal, snack
 
+    @field_validator("timestamp")
+    @classmethod
+    def _naive_utc(cls, ts: Optional[datetime]) -> Optional[datetime]:
+        # Meals are stored and bucketed by day in naive UTC
+        return as_utc(ts) if ts else ts
+
+
+class MealLogBatch(BaseModel):
+    meals: List[MealLogCreate]
+
 
 class MealPlanCreate(BaseModel):
     dog_id: int
@@ -52,12 +64,25 @@ class MealPlanCreate(BaseModel):
 
 def _verify_dog_ownership(dog_id: int, user: models.User, db: Session) -> models.Dog:
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve ou non autorise")
     return dog
 
+def _decrement_stock(db: Session, amounts: dict):
+    """Take {product_id: grams} out of the pantry in one atomic UPDATE,
+    flooring stocks at zero."""
+    if not amounts:
+        return
+    P = models.FoodProduct
+    amount = case(amounts, value=P.id)
+    db.query(P).filter(P.id.in_(list(amounts)), P.current_stock_g.isnot(None)).update(
+        {P.current_stock_g: case((P.current_stock_g > amount, P.current_stock_g - amount), else_=0)},
+        synchronize_session=False,
+    )
+
+
 def _row_to_dict(obj) -> dict:
     d = {}
     for col in obj.__table__.columns:
@@ -92,9 +117,7 @@ def log_meal(
                 calories = int((data.amount_g / 1000) * food.kcal_per_kg)
                 
             # Update Stock
-            if food.current_stock_g is not None:
-                food.current_stock_g = max(0, food.current_stock_g - data.amount_g)
-                db.add(food)
+            _decrement_stock(db, {food.id: data.amount_g})
 
     meal = models.Meal(
         dog_id=data.dog_id,
@@ -105,8 +128,11 @@ def log_meal(
         timestamp=data.timestamp or datetime.utcnow()
     )
     db.add(meal)
+    nutrition.record_meals(db, data.dog_id, [(meal, food)])
     db.commit()
     db.refresh(meal)
+    if food:
+        db.refresh(food)
     
     return {
         **_row_to_dict(meal),
@@ -115,6 +141,72 @@ def log_meal(
     }
 
 
+@router.post("/meals/batch")
+def log_meals_batch(
+    data: MealLogBatch,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Log several meals (e.g. a day's feeding schedule) in one transaction."""
+    if not data.meals:
+        return {"meals": [], "stock": {}}
+    if len(data.meals) > 100:
+        raise HTTPException(status_code=400, detail="100 repas maximum par envoi")
+
+    dog_ids = {m.dog_id for m in data.meals}
+    owned = {
+        d.id for d in db.query(models.Dog.id).filter(
+            models.Dog.id.in_(dog_ids),
+            models.Dog.owner_id == current_user.id,
+            models.Dog.deleted_at.is_(None),
+        )
+    }
+    if owned != dog_ids:
+        raise HTTPException(status_code=404, detail="Chien non trouve ou non autorise")
+
+    product_ids = {m.food_product_id for m in data.meals if m.food_product_id}
+    foods = {
+        f.id: f for f in
+        db.query(models.FoodProduct).filter(models.FoodProduct.id.in_(product_ids))
+    } if product_ids else {}
+    if any(f.user_id and f.user_id != current_user.id for f in foods.values()):
+        raise HTTPException(status_code=403, detail="Produit non autorise")
+
+    now = datetime.utcnow()
+    entries, amounts = [], {}
+    for m in data.meals:
+        food = foods.get(m.food_product_id)
+        calories = int((m.amount_g / 1000) * food.kcal_per_kg) if food and food.kcal_per_kg else 0
+        if food:
+            amounts[food.id] = amounts.get(food.id, 0) + m.amount_g
+        meal = models.Meal(
+            dog_id=m.dog_id,
+            food_product_id=m.food_product_id,
+            amount_g=m.amount_g,
+            calories=calories,
+            meal_type=m.meal_type,
+            timestamp=m.timestamp or now,
+        )
+        entries.append((meal, food))
+    db.add_all([meal for meal, _ in entries])
+    _decrement_stock(db, amounts)
+    for dog_id in dog_ids:
+        nutrition.record_meals(db, dog_id, [e for e in entries if e[0].dog_id == dog_id])
+    # Serialise before commit expires the rows
+    meals = [
+        {**_row_to_dict(meal), "food_name": food.name if food else None}
+        for meal, food in entries
+    ]
+    db.commit()
+
+    stock = {
+        p.id: p.current_stock_g for p in
+        db.query(models.FoodProduct.id, models.FoodProduct.current_stock_g)
+        .filter(models.FoodProduct.id.in_(list(amounts)))
+    } if amounts else {}
+    return {"meals": meals, "stock": stock}
+
+
 @router.get("/meals/{dog_id}")
 def get_meal_history(
     dog_id: int,
@@ -147,32 +239,68 @@ def get_nutrition_stats(
     db: Session = Depends(get_db),
 ):
     _verify_dog_ownership(dog_id, current_user, db)
-    
-    today = datetime.utcnow().date()
-    start_of_day = datetime(today.year, today.month, today.day)
-    
-    # Calories today
-    calories_today = (
-        db.query(func.sum(models.Meal.calories))
-        .filter(models.Meal.dog_id == dog_id, models.Meal.timestamp >= start_of_day)
-        .scalar()
-    ) or 0
-    
-    # Last Meal
-    last_meal = (
-        db.query(models.Meal)
-        .filter(models.Meal.dog_id == dog_id)
-        .order_by(models.Meal.timestamp.desc())
-        .first()
-    )
-    
-    last_meal_time = last_meal.timestamp.isoformat() if last_meal else None
-    
+    today = nutrition.day_of(datetime.utcnow())
+    R = models.NutritionDailyRollup
+
+    def read():
+        return {r.day: r for r in db.query(R).filter(R.dog_id == dog_id, R.day.in_([today, nutrition.ALL_TIME]))}
+
+    rows = read()
+    if nutrition.ALL_TIME not in rows:
+        nutrition.rebuild(db, dog_id)
+        db.commit()
+        rows = read()
+    day, all_time = rows.get(today), rows[nutrition.ALL_TIME]
+
     return {
-        "calories_today": calories_today,
-        "last_meal_time": last_meal_time,
-        "meals_count_today": db.query(models.Meal).filter(models.Meal.dog_id == dog_id, models.Meal.timestamp >= start_of_day).count()
+        "calories_today": day.kcal if day else 0,
+        "last_meal_time": all_time.last_meal_at.isoformat() if all_time.last_meal_at else None,
+        "meals_count_today": day.meals if day else 0,
+        "grams_today": round(day.grams, 1) if day else 0,
+        "protein_g_today": round(day.protein_g, 1) if day else 0,
+        "fat_g_today": round(day.fat_g, 1) if day else 0,
+        "fiber_g_today": round(day.fiber_g, 1) if day else 0,
+    }
+
+
+@router.get("/stats/{dog_id}/daily")
+def get_nutrition_daily(
+    dog_id: int,
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Nutrition totals per day over [start, end], zero-filled (max 366 days)."""
+    _verify_dog_ownership(dog_id, current_user, db)
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=29)
+    if start > end or (end - start).days >= 366:
+        raise HTTPException(status_code=400, detail="Periode invalide")
+    if not nutrition.ensure_rollups(db, dog_id):
+        db.commit()
+
+    R = models.NutritionDailyRollup
+    first, last = nutrition.day_of(start), nutrition.day_of(end)
+    by_day = {
+        r.day: r for r in
+        db.query(R).filter(R.dog_id == dog_id, R.day >= first, R.day <= last)
     }
+    days = []
+    cursor = first
+    while cursor <= last:
+        r = by_day.get(cursor)
+        days.append({
+            "day": cursor.date().isoformat(),
+            "meals": r.meals if r else 0,
+            "kcal": r.kcal if r else 0,
+            "grams": round(r.grams, 1) if r else 0,
+            "protein_g": round(r.protein_g, 1) if r else 0,
+            "fat_g": round(r.fat_g, 1) if r else 0,
+            "fiber_g": round(r.fiber_g, 1) if r else 0,
+        })
+        cursor += timedelta(days=1)
+    return {"dog_id": dog_id, "days": days}
 
 
 # ---- Pantry Management (Food Products) ----
@@ -210,7 +338,8 @@ def create_product(
         total_stock_g=data.total_stock_g,
         low_stock_threshold_g=data.low_stock_threshold_g,
         protein_pct=data.protein_pct,
-        fat_pct=data.fat_pct
+        fat_pct=data.fat_pct,
+        fiber_pct=data.fiber_pct,
     )
     db.add(product)
     db.commit()
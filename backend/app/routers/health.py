@@ -1,12 +1,16 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
+import heapq
+import itertools
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import models, clustering, reminders
+from ..spatial import PointLayer
 
 router = APIRouter(prefix="/api", tags=["WoofHealth"])
 
@@ -47,7 +51,7 @@ class AppointmentStatusUpdate(BaseModel):
 
 def _verify_dog_ownership(dog_id: int, user: models.User, db: Session) -> models.Dog:
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve ou non autorise")
@@ -152,6 +156,7 @@ def create_vaccination(
         batch_number=data.batch_number,
     )
     db.add(vaccination)
+    reminders.queue_if_due(db, "vaccination_due", vaccination)
     db.commit()
     db.refresh(vaccination)
     return _row_to_dict(vaccination)
@@ -190,6 +195,7 @@ def create_appointment(
         notes=data.notes,
     )
     db.add(appointment)
+    reminders.queue_if_due(db, "appointment", appointment)
     db.commit()
     db.refresh(appointment)
     return _row_to_dict(appointment)
@@ -201,6 +207,97 @@ def create_appointment(
     return _row_to_dict(appointment)
 
 
+# ---- Timeline ----
+
+# Kinds in tie-break order for entries sharing a date
+TIMELINE_KINDS = {
+    "appointment": models.VetAppointment,
+    "record": models.HealthRecord,
+    "vaccination": models.VetVaccination,
+}
+TIMELINE_RANK = {kind: i for i, kind in enumerate(TIMELINE_KINDS)}
+
+
+def _parse_timeline_cursor(cursor: str):
+    try:
+        date, kind, id = cursor.split("|")
+        if kind not in TIMELINE_KINDS:
+            raise ValueError(kind)
+        return datetime.fromisoformat(date), kind, int(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
+
+def _timeline_stream(db: Session, kind: str, dog_id: int, after, limit: int):
+    """Entries of one kind, newest first, strictly after the `after` position
+    of the merged order (date desc, kind, id desc)."""
+    model = TIMELINE_KINDS[kind]
+    query = db.query(model).filter(model.dog_id == dog_id)
+    if after:
+        date, after_kind, after_id = after
+        if TIMELINE_RANK[kind] > TIMELINE_RANK[after_kind]:
+            query = query.filter(model.date <= date)
+        elif kind == after_kind:
+            query = query.filter(or_(
+                model.date < date, and_(model.date == date, model.id < after_id)
+            ))
+        else:
+            query = query.filter(model.date < date)
+    rows = query.order_by(model.date.desc(), model.id.desc()).limit(limit)
+    return ((row.date, kind, row.id, row) for row in rows)
+
+
+@router.get("/health/timeline/{dog_id}")
+def get_health_timeline(
+    dog_id: int,
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Records, vaccinations and appointments of a dog in one feed, newest
+    first. Pass back `next_cursor` to get the following page."""
+    _verify_dog_ownership(dog_id, current_user, db)
+    after = _parse_timeline_cursor(cursor) if cursor else None
+    streams = [
+        _timeline_stream(db, kind, dog_id, after, limit + 1) for kind in TIMELINE_KINDS
+    ]
+    merged = heapq.merge(
+        *streams, key=lambda e: (e[0], -TIMELINE_RANK[e[1]], e[2]), reverse=True
+    )
+    page = list(itertools.islice(merged, limit + 1))
+    has_more = len(page) > limit
+    page = page[:limit]
+    items = []
+    for date, kind, id, row in page:
+        d = _row_to_dict(row)
+        d["kind"] = kind
+        items.append(d)
+    next_cursor = None
+    if has_more:
+        date, kind, id, _ = page[-1]
+        next_cursor = f"{date.isoformat()}|{kind}|{id}"
+    return {"items": items, "next_cursor": next_cursor}
+
+
+# ---- Reminders ----
+
+@router.get("/health/reminders")
+def get_reminders(
+    status: Optional[str] = Query(None, pattern="^(pending|sent)$"),
+    limit: int = Query(50, ge=1, le=200),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    query = db.query(models.NotificationOutbox).filter(
+        models.NotificationOutbox.user_id == current_user.id
+    )
+    if status:
+        query = query.filter(models.NotificationOutbox.status == status)
+    items = query.order_by(models.NotificationOutbox.due_at.asc()).limit(limit).all()
+    return [_row_to_dict(n) for n in items]
+
+
 # ---- Vets ----
 
 class VetCreate(BaseModel):
@@ -214,31 +311,55 @@ class VetCreate(BaseModel):
     longitude: Optional[float] = None
 
 
+def _load_vets(db: Session):
+    rows = db.query(
+        models.VetClinic.id, models.VetClinic.latitude, models.VetClinic.longitude,
+        models.VetClinic.city,
+    )
+    for r in rows:
+        yield r.id, r.latitude, r.longitude, {"city": (r.city or "").lower()}
+
+
+vet_layer = PointLayer("vets", _load_vets)
+
+
 @router.get("/health/vets")
 def search_vets(
     city: Optional[str] = Query(None),
-    lat: Optional[float] = Query(None),
-    lng: Optional[float] = Query(None),
-    radius_km: float = 10.0,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: float = Query(10.0, gt=0, le=200),
+    limit: int = Query(50, ge=1, le=200),
     db: Session = Depends(get_db),
 ):
-    query = db.query(models.VetClinic)
-    if city:
-        query = query.filter(models.VetClinic.city.ilike(f"%{city}%"))
-    
-    # In a real app, use PostGIS. Here we simply filter by rough bounding box if lat/lng provided
-    if lat and lng:
-        # Crude approximation: 1 deg lat ~ 111km
-        lat_delta = radius_km / 111.0
-        lng_delta = radius_km / (111.0 * 0.7) # approx at 45deg lat
-        
-        query = query.filter(
-            models.VetClinic.latitude.between(lat - lat_delta, lat + lat_delta),
-            models.VetClinic.longitude.between(lng - lng_delta, lng + lng_delta)
-        )
-        
-    vets = query.limit(50).all()
-    return [_row_to_dict(v) for v in vets]
+    """Vets by city, or within `radius_km` of (`lat`, `lng`) nearest first
+    with their haversine `distance_km`."""
+    if lat is None or lng is None:
+        query = db.query(models.VetClinic)
+        if city:
+            query = query.filter(models.VetClinic.city.ilike(f"%{city}%"))
+        vets = query.order_by(models.VetClinic.name).limit(limit).all()
+        return [_row_to_dict(v) for v in vets]
+
+    city_key = city.lower() if city else None
+    hits = vet_layer.within(
+        db, lat, lng, radius_km,
+        (lambda p: city_key in p["city"]) if city_key else None,
+    )[:limit]
+    if not hits:
+        return []
+    vets = {
+        v.id: v for v in
+        db.query(models.VetClinic).filter(models.VetClinic.id.in_([h[1][0] for h in hits]))
+    }
+    results = []
+    for distance, entry in hits:
+        vet = vets.get(entry[0])
+        if vet:
+            d = _row_to_dict(vet)
+            d["distance_km"] = round(distance, 3)
+            results.append(d)
+    return results
 
 
 @router.post("/health/vets")
@@ -260,6 +381,9 @@ def create_vet(
     db.add(vet)
     db.commit()
     db.refresh(vet)
+    vet_layer.add(vet.id, vet.latitude, vet.longitude, {"city": (vet.city or "").lower()})
+    clustering.LAYERS["vets"].add(vet.id, vet.latitude, vet.longitude,
+                                  {"name": vet.name, "type": "vet"})
     return _row_to_dict(vet)
 
 
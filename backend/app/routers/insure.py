@@ -75,7 +75,7 @@ def submit_claim(
     current_user: models.User = Depends(get_current_user),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
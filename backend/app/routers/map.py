@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from ..database import get_db
+from ..auth import get_current_user
+from .. import models, clustering
+
+router = APIRouter(prefix="/api", tags=["WoofMap"])
+
+
+@router.get("/map/clusters")
+def get_map_clusters(
+    layer: str = Query(...),
+    south: float = Query(..., ge=-90, le=90),
+    west: float = Query(..., ge=-180, le=180),
+    north: float = Query(..., ge=-90, le=90),
+    east: float = Query(..., ge=-180, le=180),
+    zoom: int = Query(..., ge=0, le=22),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Clusters of a map layer (spots, places, vets, danger) visible in a
+    bbox at `zoom`. Single points carry `point_id`, `name` and `type`."""
+    if layer not in clustering.LAYERS:
+        raise HTTPException(status_code=404, detail="Couche inconnue")
+    if south > north:
+        raise HTTPException(status_code=400, detail="Zone invalide")
+    clusters = clustering.LAYERS[layer].get_clusters(db, south, west, north, east, zoom)
+    return {"layer": layer, "zoom": zoom, "clusters": clusters}
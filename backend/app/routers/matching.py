@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from sqlalchemy import and_, or_, func, select
 from math import radians, cos, sin, asin, sqrt
 from typing import Optional
 from datetime import date
@@ -149,7 +149,7 @@ def discover_dogs(
     db: Session = Depends(get_db),
 ):
     my_dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not my_dog:
         raise HTTPException(status_code=404, detail="Chien non trouvé")
@@ -163,6 +163,7 @@ def discover_dogs(
     query = db.query(models.Dog).filter(
         models.Dog.id.notin_(already_swiped_ids),
         models.Dog.owner_id != current_user.id,
+        models.Dog.deleted_at.is_(None),
     )
 
     if breed_filter:
@@ -200,7 +201,7 @@ def swipe(
     db: Session = Depends(get_db),
 ):
     my_dog = db.query(models.Dog).filter(
-        models.Dog.id == data.swiper_dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == data.swiper_dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not my_dog:
         raise HTTPException(status_code=403, detail="Ce n'est pas votre chien")
@@ -226,7 +227,7 @@ def swipe(
             sl_used = (
                 db.query(models.Swipe)
                 .filter(
-                    models.Swipe.swiper_dog_id.in_([d.id for d in current_user.dogs]),
+                    models.Swipe.swiper_dog_id.in_([d.id for d in current_user.active_dogs]),
                     models.Swipe.action == "super_like",
                     func.date(models.Swipe.created_at) == today,
                 )
@@ -277,16 +278,19 @@ def get_matches(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    my_dog_ids = [d.id for d in current_user.dogs]
+    my_dog_ids = [d.id for d in current_user.active_dogs]
     if not my_dog_ids:
         return []
 
+    deleted_dog_ids = select(models.Dog.id).where(models.Dog.deleted_at.isnot(None))
     matches = db.query(models.Match).filter(
         models.Match.is_active == True,
         or_(
             models.Match.dog_1_id.in_(my_dog_ids),
             models.Match.dog_2_id.in_(my_dog_ids),
         ),
+        models.Match.dog_1_id.notin_(deleted_dog_ids),
+        models.Match.dog_2_id.notin_(deleted_dog_ids),
     ).order_by(models.Match.created_at.desc()).all()
     return matches
 
@@ -324,7 +328,9 @@ def search_dogs(
             detail="La recherche avancée est réservée aux plans Pâtée et Os en Or. Mettez à niveau votre abonnement !",
         )
 
-    query = db.query(models.Dog).filter(models.Dog.owner_id != current_user.id)
+    query = db.query(models.Dog).filter(
+        models.Dog.owner_id != current_user.id, models.Dog.deleted_at.is_(None)
+    )
 
     if breed:
         query = query.filter(models.Dog.breed.ilike(f"%{breed}%"))
@@ -509,8 +515,12 @@ def puppy_predictor(
             detail="Le Puppy Predictor est réservé aux plans Pâtée et Os en Or.",
         )
 
-    dog1 = db.query(models.Dog).filter(models.Dog.id == data.dog_1_id).first()
-    dog2 = db.query(models.Dog).filter(models.Dog.id == data.dog_2_id).first()
+    dog1 = db.query(models.Dog).filter(
+        models.Dog.id == data.dog_1_id, models.Dog.deleted_at.is_(None)
+    ).first()
+    dog2 = db.query(models.Dog).filter(
+        models.Dog.id == data.dog_2_id, models.Dog.deleted_at.is_(None)
+    ).first()
     if not dog1 or not dog2:
         raise HTTPException(status_code=404, detail="Chien(s) non trouvé(s)")
 
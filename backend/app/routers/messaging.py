@@ -10,7 +10,7 @@ router = APIRouter(prefix="/api", tags=["messaging"])
 
 
 def user_in_match(user: models.User, match: models.Match, db: Session) -> bool:
-    my_dog_ids = [d.id for d in user.dogs]
+    my_dog_ids = [d.id for d in user.active_dogs]
     return match.dog_1_id in my_dog_ids or match.dog_2_id in my_dog_ids
 
 
@@ -49,7 +49,7 @@ def create_tag(
     current_user: models.User = Depends(get_current_user),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
@@ -78,7 +78,7 @@ def get_tags_for_dog(
     current_user: models.User = Depends(get_current_user),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
@@ -110,7 +110,9 @@ def scan_tag(
     tag.scans_count = (tag.scans_count or 0) + 1
     db.commit()
 
-    dog = db.query(models.Dog).filter(models.Dog.id == tag.dog_id).first()
+    dog = db.query(models.Dog).filter(
+        models.Dog.id == tag.dog_id, models.Dog.deleted_at.is_(None)
+    ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
 
@@ -142,7 +144,7 @@ def deactivate_tag(
         raise HTTPException(status_code=404, detail="Tag non trouve")
 
     dog = db.query(models.Dog).filter(
-        models.Dog.id == tag.dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == tag.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=403, detail="Acces refuse")
@@ -161,7 +163,7 @@ def report_lost_pet(
     current_user: models.User = Depends(get_current_user),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
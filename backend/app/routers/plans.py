@@ -79,7 +79,7 @@ def get_plan_limits(plan: str) -> dict:
 
 
 def count_today_swipes(user: models.User, db: Session) -> int:
-    my_dog_ids = [d.id for d in user.dogs]
+    my_dog_ids = [d.id for d in user.active_dogs]
     if not my_dog_ids:
         return 0
     today = date.today()
@@ -6,6 +6,7 @@ import os, uuid, shutil
 from ..database import get_db
 from ..auth import get_password_hash, verify_password, create_access_token, get_current_user
 from .. import models, schemas
+from ..deletion import schedule_deletion
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
@@ -36,7 +37,9 @@ def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
 
 @router.post("/auth/login", response_model=schemas.Token)
 def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == form.username).first()
+    user = db.query(models.User).filter(
+        models.User.email == form.username, models.User.deleted_at.is_(None)
+    ).first()
     if not user or not verify_password(form.password, user.hashed_password):
         raise HTTPException(status_code=401, detail="Email ou mot de passe incorrect")
 
@@ -84,6 +87,15 @@ def get_hub_order(
     return {"hub_order": None}
 
 
+@router.delete("/me")
+def delete_account(
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    schedule_deletion(db, "user", current_user)
+    return {"status": "deleted"}
+
+
 # ---- Dogs ----
 @router.post("/dogs", response_model=schemas.DogOut)
 def create_dog(
@@ -103,12 +115,16 @@ def get_my_dogs(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    return db.query(models.Dog).filter(models.Dog.owner_id == current_user.id).all()
+    return db.query(models.Dog).filter(
+        models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
+    ).all()
 
 
 @router.get("/dogs/{dog_id}", response_model=schemas.DogOut)
 def get_dog(dog_id: int, db: Session = Depends(get_db)):
-    dog = db.query(models.Dog).filter(models.Dog.id == dog_id).first()
+    dog = db.query(models.Dog).filter(
+        models.Dog.id == dog_id, models.Dog.deleted_at.is_(None)
+    ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouvé")
     return dog
@@ -122,7 +138,7 @@ def update_dog(
     db: Session = Depends(get_db),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouvé")
@@ -143,12 +159,11 @@ def delete_dog(
     db: Session = Depends(get_db),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouvé")
-    db.delete(dog)
-    db.commit()
+    schedule_deletion(db, "dog", dog)
     return {"status": "deleted"}
 
 
@@ -183,7 +198,7 @@ def verify_health(
     db: Session = Depends(get_db),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouvé")
@@ -201,7 +216,7 @@ def verify_breeder(
     db: Session = Depends(get_db),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouvé")
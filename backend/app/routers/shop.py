@@ -1,13 +1,14 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, case, or_
 from pydantic import BaseModel
 from typing import Optional
 from datetime import datetime
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import models, recommendations, reservations
+from ..product_search import catalog
 
 router = APIRouter(prefix="/api", tags=["WoofShop"])
 
@@ -27,6 +28,72 @@ class OrderCreate(BaseModel):
     shipping_address: str
 
 
+# ---- Helpers ----
+
+def _cart_rows(db: Session, user_id: int, lock: bool = False):
+    """The user's cart items with their products, in one joined query."""
+    query = (
+        db.query(models.CartItem, models.Product)
+        .outerjoin(models.Product, models.Product.id == models.CartItem.product_id)
+        .filter(models.CartItem.user_id == user_id)
+        .order_by(models.CartItem.id)
+    )
+    if lock:
+        # Keeps the reservation expirer off these items until we commit
+        query = query.with_for_update(of=models.CartItem)
+    return query.all()
+
+
+def _take_stock(db: Session, quantities: dict, held: dict) -> bool:
+    """Take {product_id: quantity} out of stock in one conditional UPDATE,
+    turning the {product_id: units} the cart already `held` into sales.
+
+    Returns False, leaving every stock untouched, unless all products had
+    enough; the caller rolls back on False."""
+    P = models.Product
+    qty = case(quantities, value=P.id)
+    mine = case(held, value=P.id, else_=0) if held else 0
+    taken = db.query(P).filter(P.id.in_(list(quantities)), P.stock - P.reserved + mine >= qty).update(
+        {P.stock: P.stock - qty, P.reserved: P.reserved - mine}, synchronize_session=False,
+    )
+    return taken == len(quantities)
+
+
+def _claim_hold(db: Session, item: models.CartItem) -> bool:
+    """Clear the hold of `item` if it is still what was read, so the expiry
+    job cannot release the same units; only claimed holds count as held."""
+    C = models.CartItem
+    return bool(
+        db.query(C)
+        .filter(C.id == item.id, C.reserved_qty == item.reserved_qty)
+        .update({C.reserved_qty: 0, C.reserved_until: None}, synchronize_session=False)
+    )
+
+
+def _products_in_order(db: Session, ids: list) -> list:
+    products = {
+        p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(ids))
+    } if ids else {}
+    return [_product_dict(products[id]) for id in ids if id in products]
+
+
+def _product_dict(p: models.Product) -> dict:
+    return {
+        "id": p.id,
+        "name": p.name,
+        "description": p.description,
+        "price": p.price,
+        "category": p.category,
+        "image_url": p.image_url,
+        "stock": p.stock,
+        "reserved": p.reserved or 0,
+        "available": reservations.available(p),
+        "rating": p.rating,
+        "brand": p.brand,
+        "is_featured": p.is_featured,
+    }
+
+
 # ---- Products ----
 
 @router.get("/shop/products")
@@ -63,21 +130,29 @@ def list_products(
     else:
         query = query.order_by(models.Product.created_at.desc())
     products = query.offset(skip).limit(limit).all()
-    return [
-        {
-            "id": p.id,
-            "name": p.name,
-            "description": p.description,
-            "price": p.price,
-            "category": p.category,
-            "image_url": p.image_url,
-            "stock": p.stock,
-            "rating": p.rating,
-            "brand": p.brand,
-            "is_featured": p.is_featured,
-        }
-        for p in products
-    ]
+    return [_product_dict(p) for p in products]
+
+
+@router.get("/shop/search")
+def search_products(
+    q: Optional[str] = Query(None),
+    category: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    min_rating: Optional[float] = Query(None),
+    sort_by: Optional[str] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """Full-text search over the catalog with category, price and rating
+    facet counts for the whole result set."""
+    ids, facets = catalog.search(db, q, category, min_price, max_price, min_rating, sort_by)
+    return {
+        "total": len(ids),
+        "items": _products_in_order(db, ids[skip:skip + limit]),
+        "facets": facets,
+    }
 
 
 @router.get("/shop/products/{product_id}")
@@ -91,31 +166,26 @@ def get_product(
     if not product:
         raise HTTPException(status_code=404, detail="Produit non trouve")
     return {
-        "id": product.id,
-        "name": product.name,
-        "description": product.description,
-        "price": product.price,
-        "category": product.category,
-        "image_url": product.image_url,
-        "stock": product.stock,
-        "rating": product.rating,
-        "brand": product.brand,
-        "is_featured": product.is_featured,
+        **_product_dict(product),
         "created_at": product.created_at.isoformat() if product.created_at else None,
     }
 
 
+@router.get("/shop/products/{product_id}/recommendations")
+def get_product_recommendations(
+    product_id: int,
+    limit: int = Query(6, ge=1, le=recommendations.TOP_N),
+    db: Session = Depends(get_db),
+):
+    """Products frequently bought together with this one."""
+    return _products_in_order(db, recommendations.for_products(db, [product_id], limit))
+
+
 @router.get("/shop/categories")
 def list_categories(
     db: Session = Depends(get_db),
 ):
-    categories = (
-        db.query(models.Product.category)
-        .distinct()
-        .order_by(models.Product.category)
-        .all()
-    )
-    return [c[0] for c in categories]
+    return catalog.index(db).categories
 
 
 # ---- Cart ----
@@ -125,17 +195,9 @@ def get_cart(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    items = (
-        db.query(models.CartItem)
-        .filter(models.CartItem.user_id == current_user.id)
-        .all()
-    )
     cart_items = []
     total = 0.0
-    for item in items:
-        product = db.query(models.Product).filter(
-            models.Product.id == item.product_id
-        ).first()
+    for item, product in _cart_rows(db, current_user.id):
         if product:
             subtotal = product.price * item.quantity
             total += subtotal
@@ -147,10 +209,27 @@ def get_cart(
                 "price": product.price,
                 "quantity": item.quantity,
                 "subtotal": round(subtotal, 2),
+                "reserved_until": item.reserved_until.isoformat() if item.reserved_until else None,
             })
     return {"items": cart_items, "total": round(total, 2)}
 
 
+@router.get("/shop/cart/recommendations")
+def get_cart_recommendations(
+    limit: int = Query(6, ge=1, le=20),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Products frequently bought with what is in the cart."""
+    in_cart = [
+        pid for (pid,) in db.query(models.CartItem.product_id)
+        .filter(models.CartItem.user_id == current_user.id)
+    ]
+    if not in_cart:
+        return []
+    return _products_in_order(db, recommendations.for_products(db, in_cart, limit))
+
+
 @router.post("/shop/cart")
 def add_to_cart(
     data: CartItemCreate,
@@ -162,13 +241,16 @@ def add_to_cart(
     ).first()
     if not product:
         raise HTTPException(status_code=404, detail="Produit non trouve")
-    if product.stock < data.quantity:
-        raise HTTPException(status_code=400, detail="Stock insuffisant")
+    if data.quantity < 1:
+        raise HTTPException(status_code=400, detail="Quantite invalide")
     existing = db.query(models.CartItem).filter(
         models.CartItem.user_id == current_user.id,
         models.CartItem.product_id == data.product_id,
-    ).first()
+    ).with_for_update().first()
     if existing:
+        if not reservations.hold(db, existing, existing.quantity + data.quantity):
+            db.rollback()
+            raise HTTPException(status_code=400, detail="Stock insuffisant")
         existing.quantity += data.quantity
         db.commit()
         db.refresh(existing)
@@ -182,7 +264,11 @@ def add_to_cart(
             user_id=current_user.id,
             product_id=data.product_id,
             quantity=data.quantity,
+            reserved_qty=0,
         )
+        if not reservations.hold(db, cart_item, data.quantity):
+            db.rollback()
+            raise HTTPException(status_code=400, detail="Stock insuffisant")
         db.add(cart_item)
         db.commit()
         db.refresh(cart_item)
@@ -203,17 +289,16 @@ def update_cart_item(
     item = db.query(models.CartItem).filter(
         models.CartItem.id == item_id,
         models.CartItem.user_id == current_user.id,
-    ).first()
+    ).with_for_update().first()
     if not item:
         raise HTTPException(status_code=404, detail="Article non trouve dans le panier")
     if data.quantity <= 0:
+        reservations.release_items(db, [item.id])
         db.delete(item)
         db.commit()
         return {"status": "removed"}
-    product = db.query(models.Product).filter(
-        models.Product.id == item.product_id
-    ).first()
-    if product and product.stock < data.quantity:
+    if not reservations.hold(db, item, data.quantity):
+        db.rollback()
         raise HTTPException(status_code=400, detail="Stock insuffisant")
     item.quantity = data.quantity
     db.commit()
@@ -237,6 +322,7 @@ def remove_from_cart(
     ).first()
     if not item:
         raise HTTPException(status_code=404, detail="Article non trouve dans le panier")
+    reservations.release_items(db, [item.id])
     db.delete(item)
     db.commit()
     return {"status": "removed"}
@@ -250,38 +336,37 @@ def place_order(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    cart_items = (
-        db.query(models.CartItem)
-        .filter(models.CartItem.user_id == current_user.id)
-        .all()
-    )
-    if not cart_items:
+    rows = _cart_rows(db, current_user.id, lock=True)
+    if not rows:
         raise HTTPException(status_code=400, detail="Votre panier est vide")
 
-    total = 0.0
-    order_items_data = []
-    for item in cart_items:
-        product = db.query(models.Product).filter(
-            models.Product.id == item.product_id
-        ).first()
+    products = {}
+    quantities = {}
+    held = {}
+    for item, product in rows:
         if not product:
             raise HTTPException(
                 status_code=400,
                 detail=f"Produit {item.product_id} non trouve",
             )
-        if product.stock < item.quantity:
+        products[product.id] = product
+        quantities[product.id] = quantities.get(product.id, 0) + item.quantity
+        if item.reserved_qty and _claim_hold(db, item):
+            held[product.id] = held.get(product.id, 0) + item.reserved_qty
+    for product_id, quantity in quantities.items():
+        if reservations.available(products[product_id]) + held.get(product_id, 0) < quantity:
             raise HTTPException(
                 status_code=400,
-                detail=f"Stock insuffisant pour {product.name}",
+                detail=f"Stock insuffisant pour {products[product_id].name}",
             )
-        subtotal = product.price * item.quantity
-        total += subtotal
-        order_items_data.append({
-            "product_id": product.id,
-            "quantity": item.quantity,
-            "price": product.price,
-        })
 
+    # The check above read a snapshot and FOR UPDATE is a no-op on SQLite;
+    # the conditional UPDATE re-checks every stock as it takes it
+    if not _take_stock(db, quantities, held):
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Stock insuffisant, veuillez verifier votre panier")
+
+    total = sum(products[pid].price * q for pid, q in quantities.items())
     order = models.Order(
         user_id=current_user.id,
         total=round(total, 2),
@@ -290,24 +375,20 @@ def place_order(
     )
     db.add(order)
     db.flush()
-
-    for oi_data in order_items_data:
-        order_item = models.OrderItem(
+    db.add_all([
+        models.OrderItem(
             order_id=order.id,
-            product_id=oi_data["product_id"],
-            quantity=oi_data["quantity"],
-            price=oi_data["price"],
+            product_id=product_id,
+            quantity=quantity,
+            price=products[product_id].price,
         )
-        db.add(order_item)
-        product = db.query(models.Product).filter(
-            models.Product.id == oi_data["product_id"]
-        ).first()
-        if product:
-            product.stock -= oi_data["quantity"]
+        for product_id, quantity in quantities.items()
+    ])
 
+    # Only the rows read above: an item added meanwhile keeps its hold
     db.query(models.CartItem).filter(
-        models.CartItem.user_id == current_user.id
-    ).delete()
+        models.CartItem.id.in_([item.id for item, _ in rows])
+    ).delete(synchronize_session=False)
     db.commit()
     db.refresh(order)
 
@@ -320,6 +401,44 @@ def place_order(
     }
 
 
+def _orders_with_items(db: Session, orders: list) -> list:
+    """Nest items and their products under a page of orders, with one
+    query for all the items and one for all their products."""
+    order_ids = [o.id for o in orders]
+    items = (
+        db.query(models.OrderItem)
+        .filter(models.OrderItem.order_id.in_(order_ids))
+        .order_by(models.OrderItem.id)
+        .all()
+    ) if order_ids else []
+    product_ids = {i.product_id for i in items}
+    products = {
+        p.id: p for p in db.query(models.Product).filter(models.Product.id.in_(product_ids))
+    } if product_ids else {}
+    by_order = {}
+    for item in items:
+        product = products.get(item.product_id)
+        by_order.setdefault(item.order_id, []).append({
+            "id": item.id,
+            "product_id": item.product_id,
+            "product_name": product.name if product else None,
+            "product_image": product.image_url if product else None,
+            "quantity": item.quantity,
+            "price": item.price,
+        })
+    return [
+        {
+            "id": order.id,
+            "total": order.total,
+            "status": order.status,
+            "shipping_address": order.shipping_address,
+            "created_at": order.created_at.isoformat() if order.created_at else None,
+            "items": by_order.get(order.id, []),
+        }
+        for order in orders
+    ]
+
+
 @router.get("/shop/orders")
 def get_orders(
     current_user: models.User = Depends(get_current_user),
@@ -328,33 +447,33 @@ def get_orders(
     orders = (
         db.query(models.Order)
         .filter(models.Order.user_id == current_user.id)
-        .order_by(models.Order.created_at.desc())
+        .order_by(models.Order.created_at.desc(), models.Order.id.desc())
         .all()
     )
-    results = []
-    for order in orders:
-        items = db.query(models.OrderItem).filter(
-            models.OrderItem.order_id == order.id
-        ).all()
-        items_list = []
-        for item in items:
-            product = db.query(models.Product).filter(
-                models.Product.id == item.product_id
-            ).first()
-            items_list.append({
-                "id": item.id,
-                "product_id": item.product_id,
-                "product_name": product.name if product else None,
-                "product_image": product.image_url if product else None,
-                "quantity": item.quantity,
-                "price": item.price,
-            })
-        results.append({
-            "id": order.id,
-            "total": order.total,
-            "status": order.status,
-            "shipping_address": order.shipping_address,
-            "created_at": order.created_at.isoformat() if order.created_at else None,
-            "items": items_list,
-        })
-    return results
+    return _orders_with_items(db, orders)
+
+
+@router.get("/shop/orders/history")
+def get_order_history(
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """The user's orders, newest first, with their items. Pass back
+    `next_cursor` to get older orders."""
+    O = models.Order
+    query = db.query(O).filter(O.user_id == current_user.id)
+    if cursor:
+        try:
+            created, id = cursor.split("|")
+            created, id = datetime.fromisoformat(created), int(id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Curseur invalide")
+        query = query.filter(or_(O.created_at < created, and_(O.created_at == created, O.id < id)))
+    orders = query.order_by(O.created_at.desc(), O.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = f"{orders[-1].created_at.isoformat()}|{orders[-1].id}"
+    return {"items": _orders_with_items(db, orders), "next_cursor": next_cursor}
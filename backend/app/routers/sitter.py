@@ -1,13 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, func, or_
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+import math
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import availability, models
+from ..spatial import PointLayer
 
 router = APIRouter(prefix="/api", tags=["WoofSitter"])
 
@@ -58,16 +60,22 @@ class ReviewCreate(BaseModel):
 
 def _verify_dog_ownership(dog_id: int, user: models.User, db: Session) -> models.Dog:
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve ou non autorise")
     return dog
 
 
+# Bookkeeping columns kept out of API responses
+_INTERNAL_COLUMNS = {"bookings_version", "rating_sum"}
+
+
 def _row_to_dict(obj) -> dict:
     d = {}
     for col in obj.__table__.columns:
+        if col.name in _INTERNAL_COLUMNS:
+            continue
         val = getattr(obj, col.name)
         if isinstance(val, datetime):
             val = val.isoformat()
@@ -75,8 +83,67 @@ def _row_to_dict(obj) -> dict:
     return d
 
 
+def _lookup(db: Session, key_col, value_col, ids, *joins) -> dict:
+    """Map ids to a column of their rows with one IN query, so a page of
+    bookings or reviews resolves each related entity type at once."""
+    ids = {i for i in ids if i is not None}
+    if not ids:
+        return {}
+    query = db.query(key_col, value_col)
+    for target, onclause in joins:
+        query = query.join(target, onclause)
+    return dict(query.filter(key_col.in_(ids)).all())
+
+
 # ---- Sitter Search ----
 
+def _load_sitters(db: Session):
+    rows = (
+        db.query(models.SitterProfile.id, models.User.latitude, models.User.longitude)
+        .join(models.User, models.SitterProfile.user_id == models.User.id)
+        .filter(models.User.deleted_at.is_(None))
+    )
+    for r in rows:
+        yield r.id, r.latitude, r.longitude, {}
+
+
+sitter_layer = PointLayer("sitters", _load_sitters)
+
+# Composite search rank: share of smoothed rating, review volume and proximity
+RANK_WEIGHTS = {"rating": 0.5, "reviews": 0.2, "distance": 0.3}
+RANK_REVIEWS_CAP = 100
+
+
+def _sitter_rank(sitter: models.SitterProfile, distance_km: float, radius_km: float) -> float:
+    reviews = min(1.0, math.log1p(sitter.total_reviews or 0) / math.log1p(RANK_REVIEWS_CAP))
+    score = (
+        RANK_WEIGHTS["rating"] * (sitter.ranking_score or 0) / 5
+        + RANK_WEIGHTS["reviews"] * reviews
+        + RANK_WEIGHTS["distance"] * (1 - distance_km / radius_km)
+    )
+    return round(score, 6)
+
+
+def _booking_window(start: datetime, end: datetime):
+    start, end = availability.as_utc(start), availability.as_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="La date de fin doit suivre la date de debut")
+    if end - start > timedelta(days=availability.MAX_BOOKING_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Periode limitee a {availability.MAX_BOOKING_DAYS} jours",
+        )
+    return start, end
+
+
+def _parse_rank_cursor(cursor: str):
+    try:
+        score, id = cursor.split("|")
+        return float(score), int(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Curseur invalide")
+
+
 @router.get("/sitters")
 def search_sitters(
     city: Optional[str] = Query(None),
@@ -84,54 +151,168 @@ def search_sitters(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    query = db.query(models.SitterProfile).join(
+    query = db.query(models.SitterProfile, models.User.full_name, models.User.city).join(
         models.User, models.SitterProfile.user_id == models.User.id
-    )
+    ).filter(models.User.deleted_at.is_(None))
     if city:
         query = query.filter(models.User.city.ilike(f"%{city}%"))
     if service_type:
         query = query.filter(models.SitterProfile.services.ilike(f"%{service_type}%"))
 
-    sitters = query.order_by(models.SitterProfile.rating.desc()).all()
     results = []
-    for sitter in sitters:
+    for sitter, full_name, user_city in query.order_by(models.SitterProfile.ranking_score.desc()):
         sitter_dict = _row_to_dict(sitter)
-        user = db.query(models.User).filter(models.User.id == sitter.user_id).first()
-        if user:
-            sitter_dict["user_name"] = user.full_name
-            sitter_dict["user_city"] = user.city
+        sitter_dict["user_name"] = full_name
+        sitter_dict["user_city"] = user_city
         results.append(sitter_dict)
     return results
 
 
+@router.get("/sitters/search")
+def search_sitters_nearby(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: float = Query(10.0, gt=0, le=100),
+    city: Optional[str] = Query(None),
+    services: Optional[str] = Query(None),
+    max_rate_per_day: Optional[float] = Query(None, ge=0),
+    max_rate_per_hour: Optional[float] = Query(None, ge=0),
+    has_garden: Optional[bool] = Query(None),
+    available_from: Optional[datetime] = Query(None),
+    available_to: Optional[datetime] = Query(None),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Sitters matching the filters, best first, one page at a time.
+
+    Around (`lat`, `lng`) the order is a composite rank of rating, review
+    count and distance; otherwise it is by `ranking_score`, the rating
+    smoothed towards a prior so a handful of reviews cannot top the list.
+    `services` is a comma-separated list that must all be offered. With
+    `available_from` and `available_to`, sitters fully booked at any point
+    of that range are left out. Pass back `next_cursor` to get the
+    following page."""
+    window = None
+    if available_from or available_to:
+        if not (available_from and available_to):
+            raise HTTPException(status_code=400, detail="Indiquez available_from et available_to")
+        window = _booking_window(available_from, available_to)
+    geo = lat is not None and lng is not None
+    distances = {}
+    if geo:
+        distances = {
+            entry[0]: d for d, entry in sitter_layer.within(db, lat, lng, radius_km)
+        }
+        if not distances:
+            return {"items": [], "next_cursor": None}
+
+    query = (
+        db.query(models.SitterProfile, models.User.full_name, models.User.city)
+        .join(models.User, models.SitterProfile.user_id == models.User.id)
+        .filter(models.User.deleted_at.is_(None))
+    )
+    if geo:
+        query = query.filter(models.SitterProfile.id.in_(list(distances)))
+    if city:
+        query = query.filter(models.User.city.ilike(f"%{city}%"))
+    for service in filter(None, (s.strip() for s in (services or "").split(","))):
+        query = query.filter(models.SitterProfile.services.ilike(f"%{service}%"))
+    if max_rate_per_day is not None:
+        query = query.filter(models.SitterProfile.rate_per_day <= max_rate_per_day)
+    if max_rate_per_hour is not None:
+        query = query.filter(models.SitterProfile.rate_per_hour <= max_rate_per_hour)
+    if has_garden is not None:
+        query = query.filter(models.SitterProfile.has_garden == has_garden)
+    after = _parse_rank_cursor(cursor) if cursor else None
+
+    if geo:
+        ranked = sorted(
+            (
+                (_sitter_rank(sitter, distances[sitter.id], radius_km), sitter.id, sitter, full_name, user_city)
+                for sitter, full_name, user_city in query
+            ),
+            key=lambda r: (r[0], r[1]),
+            reverse=True,
+        )
+        if after:
+            ranked = [r for r in ranked if (r[0], r[1]) < after]
+        if window:
+            full = availability.full_sitters(db, [r[2] for r in ranked], *window)
+            ranked = [r for r in ranked if r[1] not in full]
+        page = ranked[:limit + 1]
+    else:
+        score = func.coalesce(models.SitterProfile.ranking_score, 0)
+        page = []
+        # Sitters dropped as fully booked are replaced from the next batch
+        while len(page) <= limit:
+            batch = query
+            if after:
+                batch = batch.filter(or_(
+                    score < after[0],
+                    and_(score == after[0], models.SitterProfile.id < after[1]),
+                ))
+            rows = batch.order_by(score.desc(), models.SitterProfile.id.desc()).limit(limit + 1).all()
+            full = availability.full_sitters(db, [r[0] for r in rows], *window) if window else set()
+            # Keep the exact stored score: the cursor is compared with it in SQL
+            page += [
+                (sitter.ranking_score or 0, sitter.id, sitter, n, c)
+                for sitter, n, c in rows if sitter.id not in full
+            ]
+            if len(rows) <= limit:
+                break
+            after = (rows[-1][0].ranking_score or 0, rows[-1][0].id)
+
+    items = []
+    for rank, id, sitter, full_name, user_city in page[:limit]:
+        d = _row_to_dict(sitter)
+        d["user_name"] = full_name
+        d["user_city"] = user_city
+        d["rank_score"] = round(rank, 6)
+        if geo:
+            d["distance_km"] = round(distances[id], 3)
+        items.append(d)
+    next_cursor = None
+    if len(page) > limit:
+        rank, id = page[limit - 1][0], page[limit - 1][1]
+        next_cursor = f"{rank!r}|{id}"
+    return {"items": items, "next_cursor": next_cursor}
+
+
 @router.get("/sitters/bookings/mine")
 def get_my_bookings(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     bookings = (
         db.query(models.SitterBooking)
         .filter(models.SitterBooking.owner_id == current_user.id)
-        .order_by(models.SitterBooking.start_date.desc())
+        .order_by(models.SitterBooking.start_date.desc(), models.SitterBooking.id.desc())
+        .offset(skip)
+        .limit(limit)
         .all()
     )
+    sitter_names = _lookup(
+        db, models.SitterProfile.id, models.User.full_name, [b.sitter_id for b in bookings],
+        (models.User, models.SitterProfile.user_id == models.User.id),
+    )
+    dog_names = _lookup(db, models.Dog.id, models.Dog.name, [b.dog_id for b in bookings])
     results = []
     for booking in bookings:
         booking_dict = _row_to_dict(booking)
-        sitter = db.query(models.SitterProfile).filter(
-            models.SitterProfile.id == booking.sitter_id
-        ).first()
-        if sitter:
-            sitter_user = db.query(models.User).filter(models.User.id == sitter.user_id).first()
-            booking_dict["sitter_name"] = sitter_user.full_name if sitter_user else None
-        dog = db.query(models.Dog).filter(models.Dog.id == booking.dog_id).first()
-        booking_dict["dog_name"] = dog.name if dog else None
+        booking_dict["sitter_name"] = sitter_names.get(booking.sitter_id)
+        booking_dict["dog_name"] = dog_names.get(booking.dog_id)
         results.append(booking_dict)
     return results
 
 
 @router.get("/sitters/bookings/requests")
 def get_booking_requests(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -144,16 +325,18 @@ def get_booking_requests(
     bookings = (
         db.query(models.SitterBooking)
         .filter(models.SitterBooking.sitter_id == sitter_profile.id)
-        .order_by(models.SitterBooking.start_date.desc())
+        .order_by(models.SitterBooking.start_date.desc(), models.SitterBooking.id.desc())
+        .offset(skip)
+        .limit(limit)
         .all()
     )
+    owner_names = _lookup(db, models.User.id, models.User.full_name, [b.owner_id for b in bookings])
+    dog_names = _lookup(db, models.Dog.id, models.Dog.name, [b.dog_id for b in bookings])
     results = []
     for booking in bookings:
         booking_dict = _row_to_dict(booking)
-        owner = db.query(models.User).filter(models.User.id == booking.owner_id).first()
-        booking_dict["owner_name"] = owner.full_name if owner else None
-        dog = db.query(models.Dog).filter(models.Dog.id == booking.dog_id).first()
-        booking_dict["dog_name"] = dog.name if dog else None
+        booking_dict["owner_name"] = owner_names.get(booking.owner_id)
+        booking_dict["dog_name"] = dog_names.get(booking.dog_id)
         results.append(booking_dict)
     return results
 
@@ -161,36 +344,79 @@ def get_booking_requests(
 @router.get("/sitters/{sitter_id}")
 def get_sitter_profile(
     sitter_id: int,
+    reviews_skip: int = Query(0, ge=0),
+    reviews_limit: int = Query(20, ge=1, le=100),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    sitter = db.query(models.SitterProfile).filter(models.SitterProfile.id == sitter_id).first()
-    if not sitter:
+    row = (
+        db.query(models.SitterProfile, models.User.full_name, models.User.city)
+        .join(models.User, models.SitterProfile.user_id == models.User.id)
+        .filter(models.SitterProfile.id == sitter_id, models.User.deleted_at.is_(None))
+        .first()
+    )
+    if not row:
         raise HTTPException(status_code=404, detail="Pet-sitter non trouve")
+    sitter, full_name, user_city = row
 
     sitter_dict = _row_to_dict(sitter)
-
-    user = db.query(models.User).filter(models.User.id == sitter.user_id).first()
-    if user:
-        sitter_dict["user_name"] = user.full_name
-        sitter_dict["user_city"] = user.city
+    sitter_dict["user_name"] = full_name
+    sitter_dict["user_city"] = user_city
 
     reviews = (
         db.query(models.SitterReview)
         .filter(models.SitterReview.sitter_id == sitter_id)
-        .order_by(models.SitterReview.created_at.desc())
+        .order_by(models.SitterReview.created_at.desc(), models.SitterReview.id.desc())
+        .offset(reviews_skip)
+        .limit(reviews_limit)
         .all()
     )
+    reviewer_names = _lookup(db, models.User.id, models.User.full_name, [r.reviewer_id for r in reviews])
     sitter_dict["reviews"] = []
     for review in reviews:
         review_dict = _row_to_dict(review)
-        reviewer = db.query(models.User).filter(models.User.id == review.reviewer_id).first()
-        review_dict["reviewer_name"] = reviewer.full_name if reviewer else None
+        review_dict["reviewer_name"] = reviewer_names.get(review.reviewer_id)
         sitter_dict["reviews"].append(review_dict)
 
     return sitter_dict
 
 
+@router.get("/sitters/{sitter_id}/availability")
+def get_sitter_availability(
+    sitter_id: int,
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Booked and free places of a sitter over [start, end), split into
+    periods of constant load."""
+    sitter = (
+        db.query(models.SitterProfile)
+        .join(models.User, models.SitterProfile.user_id == models.User.id)
+        .filter(models.SitterProfile.id == sitter_id, models.User.deleted_at.is_(None))
+        .first()
+    )
+    if not sitter:
+        raise HTTPException(status_code=404, detail="Pet-sitter non trouve")
+    start, end = _booking_window(start, end)
+    capacity = sitter.max_dogs or 1
+    intervals = availability.overlapping(db, [sitter.id], start, end).get(sitter.id, [])
+    return {
+        "sitter_id": sitter.id,
+        "max_dogs": capacity,
+        "periods": [
+            {
+                "start": a.isoformat(),
+                "end": b.isoformat(),
+                "booked": load,
+                "available": max(capacity - load, 0),
+            }
+            for a, b, load in availability.segments(intervals, start, end)
+        ],
+    }
+
+
 # ---- Sitter Profile Management ----
 
 @router.get("/sitters/profile/me")
@@ -231,6 +457,7 @@ def create_sitter_profile(
     db.add(profile)
     db.commit()
     db.refresh(profile)
+    sitter_layer.add(profile.id, current_user.latitude, current_user.longitude)
     return _row_to_dict(profile)
 
 
@@ -257,6 +484,28 @@ def update_sitter_profile(
 
 # ---- Bookings ----
 
+def _lock_sitter(db: Session, sitter_id: int) -> Optional[models.SitterProfile]:
+    """Bump the sitter's bookings version and return it, or None if unknown.
+
+    The UPDATE takes the write lock (the row lock outside SQLite, where
+    FOR UPDATE is ignored and transactions start lazily), so capacity is
+    checked after any concurrent booking of the sitter has committed."""
+    S = models.SitterProfile
+    locked = db.query(S).filter(S.id == sitter_id).update(
+        {S.bookings_version: func.coalesce(S.bookings_version, 0) + 1},
+        synchronize_session=False,
+    )
+    if not locked:
+        return None
+    return db.query(S).filter(S.id == sitter_id).populate_existing().first()
+
+
+def _check_room(db: Session, sitter: models.SitterProfile, start: datetime, end: datetime,
+                exclude_id: Optional[int] = None):
+    if not availability.has_room(db, sitter, start, end, exclude_id):
+        raise HTTPException(status_code=409, detail="Pet-sitter complet sur ces dates")
+
+
 @router.post("/sitters/book")
 def create_booking(
     data: BookingCreate,
@@ -265,15 +514,16 @@ def create_booking(
 ):
     _verify_dog_ownership(data.dog_id, current_user, db)
 
-    sitter = db.query(models.SitterProfile).filter(
-        models.SitterProfile.id == data.sitter_id
-    ).first()
+    sitter = _lock_sitter(db, data.sitter_id)
     if not sitter:
         raise HTTPException(status_code=404, detail="Pet-sitter non trouve")
 
     if sitter.user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Vous ne pouvez pas reserver votre propre service")
 
+    data.start_date, data.end_date = _booking_window(data.start_date, data.end_date)
+    _check_room(db, sitter, data.start_date, data.end_date)
+
     # Calculate total price
     total_price = None
     if data.start_date and data.end_date:
@@ -327,6 +577,14 @@ def update_booking_status(
     if data.status not in ("confirmed", "cancelled", "completed"):
         raise HTTPException(status_code=400, detail="Statut invalide")
 
+    reactivated = (
+        data.status in availability.ACTIVE_STATUSES
+        and booking.status not in availability.ACTIVE_STATUSES
+    )
+    if reactivated and sitter_profile:
+        sitter_profile = _lock_sitter(db, sitter_profile.id)
+        _check_room(db, sitter_profile, booking.start_date, booking.end_date, exclude_id=booking.id)
+
     booking.status = data.status
     db.commit()
     db.refresh(booking)
@@ -370,26 +628,11 @@ def create_review(
         comment=data.comment,
     )
     db.add(review)
-    db.commit()
 
-    # Update sitter average rating
-    sitter = db.query(models.SitterProfile).filter(
-        models.SitterProfile.id == booking.sitter_id
-    ).first()
-    if sitter:
-        avg_result = (
-            db.query(func.avg(models.SitterReview.rating))
-            .filter(models.SitterReview.sitter_id == sitter.id)
-            .scalar()
-        )
-        total = (
-            db.query(func.count(models.SitterReview.id))
-            .filter(models.SitterReview.sitter_id == sitter.id)
-            .scalar()
-        )
-        sitter.rating = round(float(avg_result), 2) if avg_result else 0
-        sitter.total_reviews = total or 0
-        db.commit()
+    db.query(models.SitterProfile).filter(models.SitterProfile.id == booking.sitter_id).update(
+        models.sitter_rating_update(data.rating, 1), synchronize_session=False,
+    )
+    db.commit()
 
     db.refresh(review)
     return _row_to_dict(review)
@@ -8,6 +8,8 @@ from datetime import datetime
 from ..database import get_db
 from ..auth import get_current_user
 from .. import models
+from ..deletion import schedule_deletion
+from ..trending import feed as trending_feed
 
 router = APIRouter(prefix="/api", tags=["WoofSocial"])
 
@@ -42,7 +44,7 @@ def get_feed(
     feed_user_ids = followed_ids + [current_user.id]
     posts = (
         db.query(models.Post)
-        .filter(models.Post.user_id.in_(feed_user_ids))
+        .filter(models.Post.user_id.in_(feed_user_ids), models.Post.deleted_at.is_(None))
         .order_by(models.Post.created_at.desc())
         .offset(skip)
         .limit(limit)
@@ -76,6 +78,41 @@ def get_feed(
     return results
 
 
+@router.get("/social/trending")
+def get_trending(
+    city: Optional[str] = Query(None),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    if trending_feed.refreshed_at is None:
+        trending_feed.refresh(db)
+    entries = trending_feed.get(city)
+    # The snapshot is rebuilt periodically; drop posts deleted since
+    hidden = set()
+    if entries:
+        hidden = {
+            row.id
+            for row in db.query(models.Post.id).filter(
+                models.Post.id.in_([e["id"] for e in entries]),
+                models.Post.deleted_at.isnot(None),
+            )
+        }
+    page = [e for e in entries if e["id"] not in hidden][skip:skip + limit]
+    post_ids = [p["id"] for p in page]
+    liked_ids = set()
+    if post_ids:
+        liked_ids = {
+            row.post_id
+            for row in db.query(models.PostLike.post_id).filter(
+                models.PostLike.post_id.in_(post_ids),
+                models.PostLike.user_id == current_user.id,
+            )
+        }
+    return [{**p, "liked_by_me": p["id"] in liked_ids} for p in page]
+
+
 # ---- Posts CRUD ----
 
 @router.post("/social/posts")
@@ -90,7 +127,7 @@ def create_post(
         )
     if data.dog_id:
         dog = db.query(models.Dog).filter(
-            models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id
+            models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
         ).first()
         if not dog:
             raise HTTPException(status_code=404, detail="Chien non trouve")
@@ -121,7 +158,9 @@ def get_post_detail(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    post = db.query(models.Post).filter(
+        models.Post.id == post_id, models.Post.deleted_at.is_(None)
+    ).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post non trouve")
     user = db.query(models.User).filter(models.User.id == post.user_id).first()
@@ -174,18 +213,15 @@ def delete_post(
     db: Session = Depends(get_db),
 ):
     post = db.query(models.Post).filter(
-        models.Post.id == post_id, models.Post.user_id == current_user.id
+        models.Post.id == post_id,
+        models.Post.user_id == current_user.id,
+        models.Post.deleted_at.is_(None),
     ).first()
     if not post:
         raise HTTPException(
             status_code=404, detail="Post non trouve ou non autorise"
         )
-    db.query(models.PostLike).filter(models.PostLike.post_id == post_id).delete()
-    db.query(models.PostComment).filter(
-        models.PostComment.post_id == post_id
-    ).delete()
-    db.delete(post)
-    db.commit()
+    schedule_deletion(db, "post", post)
     return {"status": "deleted"}
 
 
@@ -197,7 +233,9 @@ def toggle_like(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    post = db.query(models.Post).filter(
+        models.Post.id == post_id, models.Post.deleted_at.is_(None)
+    ).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post non trouve")
     existing = db.query(models.PostLike).filter(
@@ -226,7 +264,9 @@ def add_comment(
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    post = db.query(models.Post).filter(
+        models.Post.id == post_id, models.Post.deleted_at.is_(None)
+    ).first()
     if not post:
         raise HTTPException(status_code=404, detail="Post non trouve")
     comment = models.PostComment(
@@ -290,7 +330,7 @@ def get_social_profile(
     if not user:
         raise HTTPException(status_code=404, detail="Utilisateur non trouve")
     post_count = db.query(func.count(models.Post.id)).filter(
-        models.Post.user_id == user_id
+        models.Post.user_id == user_id, models.Post.deleted_at.is_(None)
     ).scalar()
     followers_count = db.query(func.count(models.Follow.id)).filter(
         models.Follow.followed_id == user_id
@@ -309,7 +349,7 @@ def get_social_profile(
     )
     posts = (
         db.query(models.Post)
-        .filter(models.Post.user_id == user_id)
+        .filter(models.Post.user_id == user_id, models.Post.deleted_at.is_(None))
         .order_by(models.Post.created_at.desc())
         .limit(50)
         .all()
@@ -6,7 +6,7 @@ from datetime import datetime
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import models, training_catalog
 
 router = APIRouter(prefix="/api", tags=["WoofTrain"])
 
@@ -26,24 +26,7 @@ def list_programs(
     category: Optional[str] = Query(None),
     db: Session = Depends(get_db),
 ):
-    query = db.query(models.TrainingProgram)
-    if difficulty:
-        query = query.filter(models.TrainingProgram.difficulty == difficulty)
-    if category:
-        query = query.filter(models.TrainingProgram.category == category)
-    programs = query.order_by(models.TrainingProgram.title).all()
-    return [
-        {
-            "id": p.id,
-            "title": p.title,
-            "description": p.description,
-            "difficulty": p.difficulty,
-            "category": p.category,
-            "duration_weeks": p.duration_weeks,
-            "image_url": p.image_url,
-        }
-        for p in programs
-    ]
+    return training_catalog.get(db).list(difficulty, category)
 
 
 @router.get("/training/programs/{program_id}")
@@ -51,38 +34,11 @@ def get_program_detail(
     program_id: int,
     db: Session = Depends(get_db),
 ):
-    program = db.query(models.TrainingProgram).filter(
-        models.TrainingProgram.id == program_id
-    ).first()
+    catalog = training_catalog.get(db)
+    program = catalog.program(program_id)
     if not program:
         raise HTTPException(status_code=404, detail="Programme non trouve")
-    steps = (
-        db.query(models.TrainingStep)
-        .filter(models.TrainingStep.program_id == program_id)
-        .order_by(models.TrainingStep.step_number)
-        .all()
-    )
-    steps_list = [
-        {
-            "id": s.id,
-            "step_number": s.step_number,
-            "title": s.title,
-            "description": s.description,
-            "tips": s.tips,
-            "duration_minutes": s.duration_minutes,
-        }
-        for s in steps
-    ]
-    return {
-        "id": program.id,
-        "title": program.title,
-        "description": program.description,
-        "difficulty": program.difficulty,
-        "category": program.category,
-        "duration_weeks": program.duration_weeks,
-        "image_url": program.image_url,
-        "steps": steps_list,
-    }
+    return {**program, "steps": catalog.steps[program_id]}
 
 
 # ---- Progress ----
@@ -94,14 +50,11 @@ def start_program(
     db: Session = Depends(get_db),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
-    program = db.query(models.TrainingProgram).filter(
-        models.TrainingProgram.id == data.program_id
-    ).first()
-    if not program:
+    if not training_catalog.get(db).program(data.program_id):
         raise HTTPException(status_code=404, detail="Programme non trouve")
     existing = db.query(models.UserTrainingProgress).filter(
         models.UserTrainingProgress.user_id == current_user.id,
@@ -141,7 +94,7 @@ def get_progress(
     db: Session = Depends(get_db),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
@@ -154,16 +107,11 @@ def get_progress(
         .order_by(models.UserTrainingProgress.started_at.desc())
         .all()
     )
+    catalog = training_catalog.get(db)
     results = []
     for prog in progress_list:
-        program = db.query(models.TrainingProgram).filter(
-            models.TrainingProgram.id == prog.program_id
-        ).first()
-        total_steps = (
-            db.query(models.TrainingStep)
-            .filter(models.TrainingStep.program_id == prog.program_id)
-            .count()
-        )
+        program = catalog.program(prog.program_id)
+        total_steps = catalog.step_counts.get(prog.program_id, 0)
         # Determine status
         if prog.completed:
             status = "completed"
@@ -173,10 +121,10 @@ def get_progress(
         results.append({
             "id": prog.id,
             "program_id": prog.program_id,
-            "program_name": program.title if program else None,
-            "program_title": program.title if program else None,
-            "difficulty": program.difficulty if program else None,
-            "program_difficulty": program.difficulty if program else None,
+            "program_name": program["title"] if program else None,
+            "program_title": program["title"] if program else None,
+            "difficulty": program["difficulty"] if program else None,
+            "program_difficulty": program["difficulty"] if program else None,
             "current_step": prog.current_step,
             "total_steps": total_steps,
             "completed": prog.completed,
@@ -203,11 +151,7 @@ def advance_step(
         raise HTTPException(
             status_code=400, detail="Programme deja termine"
         )
-    total_steps = (
-        db.query(models.TrainingStep)
-        .filter(models.TrainingStep.program_id == progress.program_id)
-        .count()
-    )
+    total_steps = training_catalog.get(db).step_counts.get(progress.program_id, 0)
     if progress.current_step >= total_steps:
         progress.completed = True
         progress.completed_at = datetime.utcnow()
@@ -244,19 +188,15 @@ def get_my_progress(
         .order_by(models.UserTrainingProgress.started_at.desc())
         .all()
     )
+    catalog = training_catalog.get(db)
+    dog_ids = {prog.dog_id for prog in progress_list}
+    dog_names = dict(
+        db.query(models.Dog.id, models.Dog.name).filter(models.Dog.id.in_(dog_ids)).all()
+    ) if dog_ids else {}
     results = []
     for prog in progress_list:
-        program = db.query(models.TrainingProgram).filter(
-            models.TrainingProgram.id == prog.program_id
-        ).first()
-        dog = db.query(models.Dog).filter(
-            models.Dog.id == prog.dog_id
-        ).first()
-        total_steps = (
-            db.query(models.TrainingStep)
-            .filter(models.TrainingStep.program_id == prog.program_id)
-            .count()
-        )
+        program = catalog.program(prog.program_id)
+        total_steps = catalog.step_counts.get(prog.program_id, 0)
         # Determine status
         if prog.completed:
             status = "completed"
@@ -266,9 +206,9 @@ def get_my_progress(
         results.append({
             "id": prog.id,
             "program_id": prog.program_id,
-            "program_name": program.title if program else None,
-            "difficulty": program.difficulty if program else None,
-            "dog_name": dog.name if dog else None,
+            "program_name": program["title"] if program else None,
+            "difficulty": program["difficulty"] if program else None,
+            "dog_name": dog_names.get(prog.dog_id),
             "current_step": prog.current_step,
             "total_steps": total_steps,
             "completed": prog.completed,
@@ -6,7 +6,7 @@ from datetime import datetime
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from .. import models, clustering
 
 router = APIRouter(prefix="/api", tags=["WoofTravel"])
 
@@ -114,6 +114,8 @@ def create_place(
     db.add(place)
     db.commit()
     db.refresh(place)
+    clustering.LAYERS["places"].add(place.id, place.latitude, place.longitude,
+                                    {"name": place.name, "type": place.place_type})
     return {
         "id": place.id, "name": place.name, "place_type": place.place_type,
         "city": place.city, "address": place.address, "latitude": place.latitude,
@@ -181,7 +183,7 @@ def create_checklist(
     current_user: models.User = Depends(get_current_user),
 ):
     dog = db.query(models.Dog).filter(
-        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id
+        models.Dog.id == data.dog_id, models.Dog.owner_id == current_user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve")
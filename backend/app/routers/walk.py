@@ -1,19 +1,28 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from pydantic import BaseModel, field_validator
+from typing import List, Optional
+from datetime import date, datetime, timedelta
+import json
 
 from ..database import get_db
 from ..auth import get_current_user
-from .. import models
+from ..availability import as_utc
+from .. import clustering, heatmap, leaderboards, models, polyline, walk_routes, walk_stats
+from ..geo import path_length_km
+from ..spatial import PointLayer
 
 router = APIRouter(prefix="/api", tags=["WoofWalk"])
 
 
 # ---- Schemas ----
 
+def _naive_utc(ts: Optional[datetime]) -> Optional[datetime]:
+    """Client times may carry an offset; walks store naive UTC."""
+    return as_utc(ts) if ts else ts
+
+
 class WalkCreate(BaseModel):
     dog_id: int
     start_time: datetime
@@ -24,6 +33,37 @@ class WalkCreate(BaseModel):
     route_json: Optional[str] = None
     notes: Optional[str] = None
 
+    _utc = field_validator("start_time", "end_time")(_naive_utc)
+
+
+class LiveWalkStart(BaseModel):
+    dog_id: int
+    start_time: Optional[datetime] = None
+    notes: Optional[str] = None
+
+    _utc = field_validator("start_time")(_naive_utc)
+
+
+class GpsPoint(BaseModel):
+    lat: float
+    lng: float
+    # Required: fixes are deduplicated on it when a batch is re-sent
+    time: datetime
+
+    _utc = field_validator("time")(_naive_utc)
+
+
+class GpsPointBatch(BaseModel):
+    points: List[GpsPoint]
+
+
+class LiveWalkFinish(BaseModel):
+    end_time: Optional[datetime] = None
+    notes: Optional[str] = None
+    events: Optional[list] = None
+
+    _utc = field_validator("end_time")(_naive_utc)
+
 
 class WalkSpotCreate(BaseModel):
     name: str
@@ -39,7 +79,7 @@ class WalkSpotCreate(BaseModel):
 
 def _verify_dog_ownership(dog_id: int, user: models.User, db: Session) -> models.Dog:
     dog = db.query(models.Dog).filter(
-        models.Dog.id == dog_id, models.Dog.owner_id == user.id
+        models.Dog.id == dog_id, models.Dog.owner_id == user.id, models.Dog.deleted_at.is_(None)
     ).first()
     if not dog:
         raise HTTPException(status_code=404, detail="Chien non trouve ou non autorise")
@@ -56,12 +96,70 @@ def _row_to_dict(obj) -> dict:
     return d
 
 
+def _parse_route(route_json: Optional[str]):
+    """Split a client route payload into (points, events).
+
+    Accepts {"path": [...], "events": [...]} or a bare list of points, each
+    point being [lat, lng] or {"lat", "lng"}. Returns None if unparseable.
+    """
+    try:
+        data = json.loads(route_json)
+        if isinstance(data, dict):
+            path, events = data.get("path") or [], data.get("events") or []
+        elif isinstance(data, list):
+            path, events = data, []
+        else:
+            return None
+        points = [
+            (float(p["lat"]), float(p["lng"])) if isinstance(p, dict)
+            else (float(p[0]), float(p[1]))
+            for p in path
+        ]
+    except (TypeError, ValueError, KeyError, IndexError):
+        return None
+    return points, events
+
+
+def _route_json(walk: models.Walk) -> Optional[str]:
+    if walk.route_polyline is None:
+        return walk.route_json
+    return json.dumps({
+        "path": [list(p) for p in polyline.decode(walk.route_polyline)],
+        "events": json.loads(walk.route_events_json or "[]"),
+    })
+
+
+def _estimate_calories(dog: models.Dog, distance_km: float, duration_minutes: int) -> int:
+    # ~0.8 kcal per kg of body weight per km walked; fall back to the app's
+    # historical 5 kcal/min when the dog's weight is unknown
+    if dog.weight_kg:
+        return int(round(0.8 * dog.weight_kg * distance_km))
+    return int(duration_minutes * 5)
+
+
+def _walk_to_dict(walk: models.Walk, include_route: bool = True) -> dict:
+    d = _row_to_dict(walk)
+    del d["route_polyline"], d["route_events_json"]
+    d["has_route"] = bool(walk.route_polyline or walk.route_json)
+    d["route_json"] = _route_json(walk) if include_route else None
+    return d
+
+
+def _verify_walk_access(walk: models.Walk, user: models.User, db: Session):
+    dog = db.query(models.Dog).filter(
+        models.Dog.id == walk.dog_id, models.Dog.deleted_at.is_(None)
+    ).first()
+    if not dog or dog.owner_id != user.id:
+        raise HTTPException(status_code=403, detail="Accès non autorisé")
+
+
 # ---- Walks ----
 
 @router.get("/walks/{dog_id}")
 def get_walks(
     dog_id: int,
     limit: int = Query(20, ge=1, le=100),
+    include_route: bool = Query(False),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
@@ -73,7 +171,7 @@ def get_walks(
         .limit(limit)
         .all()
     )
-    return [_row_to_dict(w) for w in walks]
+    return [_walk_to_dict(w, include_route) for w in walks]
 
 
 @router.post("/walks")
@@ -91,14 +189,133 @@ def create_walk(
         distance_km=data.distance_km,
         duration_minutes=data.duration_minutes,
         calories=data.calories,
-        route_json=data.route_json,
         notes=data.notes,
     )
     db.add(walk)
+    route = _parse_route(data.route_json) if data.route_json else None
+    if route:
+        points, events = route
+        walk.route_events_json = json.dumps(events) if events else None
+        if len(points) > 1:
+            # Trust the track over the client-side odometer
+            walk.distance_km = round(path_length_km(points), 3)
+        walk_routes.store_route(db, walk, points)
+    else:
+        walk.route_json = data.route_json
+    walk_stats.record_walk(db, walk)
+    leaderboards.record_walk(db, walk, current_user)
+    db.commit()
+    db.refresh(walk)
+    return _walk_to_dict(walk)
+
+
+# ---- Live Walks ----
+
+def _get_live_walk(walk_id: int, user: models.User, db: Session) -> models.Walk:
+    walk = db.query(models.Walk).filter(
+        models.Walk.id == walk_id,
+        models.Walk.user_id == user.id,
+        models.Walk.status == "live",
+    ).first()
+    if not walk:
+        raise HTTPException(status_code=404, detail="Promenade en cours non trouvee")
+    return walk
+
+
+@router.post("/walks/live")
+def start_live_walk(
+    data: LiveWalkStart,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    _verify_dog_ownership(data.dog_id, current_user, db)
+    walk = models.Walk(
+        dog_id=data.dog_id,
+        user_id=current_user.id,
+        start_time=data.start_time or datetime.utcnow(),
+        notes=data.notes,
+        status="live",
+        route_polyline="",
+    )
+    db.add(walk)
+    db.flush()
+    db.add(models.WalkTrackState(walk_id=walk.id))
     db.commit()
     db.refresh(walk)
+    return _walk_to_dict(walk, include_route=False)
+
+
+@router.post("/walks/live/{walk_id}/points")
+def append_live_points(
+    walk_id: int,
+    data: GpsPointBatch,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Append a batch of GPS fixes and update distance/duration/calories.
+
+    Fixes not newer than the last stored one are dropped, so a batch re-sent
+    after a network timeout is not counted twice.
+    """
+    walk = _get_live_walk(walk_id, current_user, db)
+    state = db.query(models.WalkTrackState).filter(
+        models.WalkTrackState.walk_id == walk.id
+    ).first()
+
+    fixes = data.points
+    if state.last_time is not None:
+        fixes = [p for p in fixes if p.time > state.last_time]
+    points = [(p.lat, p.lng) for p in fixes]
+    if points:
+        last = (state.last_lat, state.last_lng) if state.last_lat is not None else None
+        walk.route_polyline = (walk.route_polyline or "") + polyline.encode(points, last=last)
+        walk.distance_km = round((walk.distance_km or 0) + path_length_km(points, start=last), 3)
+        state.last_lat, state.last_lng = points[-1]
+        state.last_time = max(p.time for p in fixes)
+        state.point_count = (state.point_count or 0) + len(points)
+
+    state.updated_at = datetime.utcnow()
+    last_time = state.last_time or state.updated_at
+    walk.duration_minutes = max(int((last_time - walk.start_time).total_seconds() // 60), 0)
+    walk.calories = _estimate_calories(walk.dog, walk.distance_km, walk.duration_minutes)
+    db.commit()
+    return {
+        "walk_id": walk.id,
+        "accepted": len(points),
+        "point_count": state.point_count,
+        "distance_km": walk.distance_km,
+        "duration_minutes": walk.duration_minutes,
+        "calories": walk.calories,
+    }
+
+
+@router.post("/walks/live/{walk_id}/finish")
+def finish_live_walk(
+    walk_id: int,
+    data: LiveWalkFinish,
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    walk = _get_live_walk(walk_id, current_user, db)
+    state = db.query(models.WalkTrackState).filter(
+        models.WalkTrackState.walk_id == walk.id
+    ).first()
+    walk.end_time = data.end_time or (state and state.last_time) or datetime.utcnow()
+    walk.duration_minutes = max(int((walk.end_time - walk.start_time).total_seconds() // 60), 0)
+    walk.calories = _estimate_calories(walk.dog, walk.distance_km or 0, walk.duration_minutes)
+    if data.notes is not None:
+        walk.notes = data.notes
+    if data.events:
+        walk.route_events_json = json.dumps(data.events)
+    walk.status = "completed"
+    walk_routes.store_route(db, walk, polyline.decode(walk.route_polyline or ""))
+    walk_stats.record_walk(db, walk)
+    leaderboards.record_walk(db, walk, current_user)
+    if state:
+        db.delete(state)
+    db.commit()
     db.refresh(walk)
-    return _row_to_dict(walk)
+    return _walk_to_dict(walk)
 
 
 @router.get("/walks/{walk_id}/detail")
@@ -111,12 +328,48 @@ def get_walk_detail(
     if not walk:
         raise HTTPException(status_code=404, detail="Promenade non trouvée")
     
-    # Check ownership
-    dog = db.query(models.Dog).get(walk.dog_id)
-    if not dog or dog.owner_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Accès non autorisé")
+    _verify_walk_access(walk, current_user, db)
+    return _walk_to_dict(walk)
 
-    return _row_to_dict(walk)
+
+@router.get("/walks/{walk_id}/route")
+def get_walk_route(
+    walk_id: int,
+    format: str = Query("polyline", pattern="^(polyline|geojson|json)$"),
+    zoom: Optional[int] = Query(None, ge=0, le=22),
+    full: bool = Query(False, description="Trace brute archivee, si disponible"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Stream a walk's route as an encoded polyline, GeoJSON or [lat, lng] pairs.
+
+    `zoom` selects a pre-simplified level; `full` returns the archived raw
+    track when cold storage is enabled.
+    """
+    walk = db.query(models.Walk).filter(models.Walk.id == walk_id).first()
+    if not walk:
+        raise HTTPException(status_code=404, detail="Promenade non trouvée")
+    _verify_walk_access(walk, current_user, db)
+
+    encoded = walk_routes.load_polyline(db, walk, zoom, full) if walk.route_polyline is not None else None
+    if encoded is None:
+        route = _parse_route(walk.route_json) if walk.route_json else None
+        encoded = polyline.encode(route[0]) if route else ""
+    if format == "polyline":
+        return PlainTextResponse(encoded)
+
+    def stream():
+        if format == "geojson":
+            yield '{"type":"LineString","coordinates":['
+        else:
+            yield "["
+        for i, (lat, lng) in enumerate(polyline.iter_decode(encoded)):
+            sep = "," if i else ""
+            yield f"{sep}[{lng},{lat}]" if format == "geojson" else f"{sep}[{lat},{lng}]"
+        yield "]}" if format == "geojson" else "]"
+
+    media_type = "application/geo+json" if format == "geojson" else "application/json"
+    return StreamingResponse(stream(), media_type=media_type)
 
 
 
@@ -127,43 +380,181 @@ def get_walk_stats(
     db: Session = Depends(get_db),
 ):
     _verify_dog_ownership(dog_id, current_user, db)
+    if not walk_stats.ensure_rollups(db, dog_id):
+        db.commit()
+    stats = db.query(models.WalkStatsRollup).filter(
+        models.WalkStatsRollup.dog_id == dog_id,
+        models.WalkStatsRollup.period == "all",
+    ).first()
+
+    total_walks = stats.walks or 0
+    return {
+        "dog_id": dog_id,
+        "total_walks": total_walks,
+        "total_distance_km": round(float(stats.distance_km or 0), 2),
+        "total_duration_minutes": int(stats.duration_minutes or 0),
+        "avg_distance_km": round(float(stats.distance_km or 0) / total_walks, 2) if total_walks else 0,
+    }
+
 
-    stats = (
-        db.query(
-            func.count(models.Walk.id).label("total_walks"),
-            func.coalesce(func.sum(models.Walk.distance_km), 0).label("total_distance_km"),
-            func.coalesce(func.sum(models.Walk.duration_minutes), 0).label("total_duration_minutes"),
-            func.coalesce(func.avg(models.Walk.distance_km), 0).label("avg_distance_km"),
+@router.get("/walks/{dog_id}/stats/series")
+def get_walk_stats_series(
+    dog_id: int,
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Walk totals per day, week or month over [start, end), zero-filled."""
+    _verify_dog_ownership(dog_id, current_user, db)
+    end = as_utc(end) if end else datetime.utcnow()
+    start = start and as_utc(start)
+    default_span = {"day": timedelta(days=30), "week": timedelta(weeks=12), "month": timedelta(days=365)}
+    start = walk_stats.period_start(bucket, start or end - default_span[bucket])
+    if not walk_stats.ensure_rollups(db, dog_id):
+        db.commit()
+
+    rows = (
+        db.query(models.WalkStatsRollup)
+        .filter(
+            models.WalkStatsRollup.dog_id == dog_id,
+            models.WalkStatsRollup.period == bucket,
+            models.WalkStatsRollup.period_start >= start,
+            models.WalkStatsRollup.period_start < end,
         )
-        .filter(models.Walk.dog_id == dog_id)
-        .first()
+        .all()
+    )
+    by_start = {r.period_start: r for r in rows}
+    series = []
+    cursor = start
+    while cursor < end and len(series) < 1000:
+        r = by_start.get(cursor)
+        series.append({
+            "period_start": cursor.isoformat(),
+            "walks": r.walks if r else 0,
+            "distance_km": round(float(r.distance_km), 2) if r else 0,
+            "duration_minutes": int(r.duration_minutes) if r else 0,
+            "calories": int(r.calories) if r else 0,
+        })
+        cursor = walk_stats.next_period_start(bucket, cursor)
+    return {"dog_id": dog_id, "bucket": bucket, "series": series}
+
+
+# ---- Leaderboards ----
+
+@router.get("/walk-leaderboard")
+def get_walk_leaderboard(
+    scope: str = Query("following", pattern="^(following|city)$"),
+    metric: str = Query("distance", pattern="^(distance|duration)$"),
+    week: Optional[date] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Weekly ranking of the accounts the user follows, or of their city.
+    `week` is any date in the wanted week (default: this week)."""
+    if scope == "city" and not current_user.city:
+        raise HTTPException(status_code=400, detail="Ville non renseignee dans le profil")
+    return leaderboards.board(
+        db, current_user, scope, metric, leaderboards.current_week(week), limit
     )
 
+
+# ---- Heatmap ----
+
+@router.get("/walks/heatmap/{z}/{x}/{y}")
+def get_walk_heatmap_tile(
+    z: int,
+    x: int,
+    y: int,
+    format: str = Query("json", pattern="^(json|png)$"),
+    current_user: models.User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Walk counts of a slippy-map tile, as sparse [cell, count] pairs
+    (cell = row * size + col) or as a rendered PNG."""
+    if not heatmap.valid_tile(z, x, y):
+        raise HTTPException(status_code=404, detail="Tuile non disponible")
+    if format == "png":
+        return Response(
+            heatmap.render_png(db, z, x, y),
+            media_type="image/png",
+            headers={"Cache-Control": "public, max-age=300"},
+        )
+    tile = heatmap.get_tile(db, z, x, y)
     return {
-        "dog_id": dog_id,
-        "total_walks": stats.total_walks,
-        "total_distance_km": round(float(stats.total_distance_km), 2),
-        "total_duration_minutes": int(stats.total_duration_minutes),
-        "avg_distance_km": round(float(stats.avg_distance_km), 2),
+        "z": z, "x": x, "y": y,
+        "size": heatmap.CELLS,
+        "version": tile.version if tile else 0,
+        "max_count": tile.max_count if tile else 0,
+        "cells": heatmap.tile_cells(db, tile),
     }
 
 
 # ---- Walk Spots ----
 
+def _load_spots(db: Session):
+    rows = db.query(
+        models.WalkSpot.id, models.WalkSpot.latitude, models.WalkSpot.longitude,
+        models.WalkSpot.spot_type, models.WalkSpot.city,
+    )
+    for r in rows:
+        yield r.id, r.latitude, r.longitude, {"spot_type": r.spot_type, "city": (r.city or "").lower()}
+
+
+spot_layer = PointLayer("walk_spots", _load_spots)
+
+
 @router.get("/walk-spots")
 def get_walk_spots(
     city: Optional[str] = Query(None),
     spot_type: Optional[str] = Query(None),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0, le=200),
+    k: Optional[int] = Query(None, ge=1, le=200),
+    skip: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
     current_user: models.User = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
-    query = db.query(models.WalkSpot)
-    if city:
-        query = query.filter(models.WalkSpot.city.ilike(f"%{city}%"))
-    if spot_type:
-        query = query.filter(models.WalkSpot.spot_type == spot_type)
-    spots = query.order_by(models.WalkSpot.rating.desc()).all()
-    return [_row_to_dict(s) for s in spots]
+    """Spots by rating, or around (`lat`, `lng`): within `radius_km`
+    (default 5 km), or the `k` nearest when `k` is given."""
+    if lat is None or lng is None:
+        query = db.query(models.WalkSpot)
+        if city:
+            query = query.filter(models.WalkSpot.city.ilike(f"%{city}%"))
+        if spot_type:
+            query = query.filter(models.WalkSpot.spot_type == spot_type)
+        spots = query.order_by(models.WalkSpot.rating.desc()).offset(skip).limit(limit).all()
+        return [_row_to_dict(s) for s in spots]
+
+    city_key = city.lower() if city else None
+
+    def matches(payload: dict) -> bool:
+        if spot_type and payload["spot_type"] != spot_type:
+            return False
+        return not city_key or city_key in payload["city"]
+
+    if k:
+        hits = spot_layer.nearest(db, lat, lng, skip + k, matches, max_radius_km=radius_km)[skip:]
+    else:
+        hits = spot_layer.within(db, lat, lng, radius_km or 5, matches)[skip:skip + limit]
+    if not hits:
+        return []
+    spots = {
+        s.id: s for s in
+        db.query(models.WalkSpot).filter(models.WalkSpot.id.in_([h[1][0] for h in hits]))
+    }
+    results = []
+    for distance, entry in hits:
+        spot = spots.get(entry[0])
+        if spot:
+            d = _row_to_dict(spot)
+            d["distance_km"] = round(distance, 3)
+            results.append(d)
+    return results
 
 
 @router.post("/walk-spots")
@@ -185,6 +576,10 @@ def create_walk_spot(
     db.add(spot)
     db.commit()
     db.refresh(spot)
+    spot_layer.add(spot.id, spot.latitude, spot.longitude,
+                   {"spot_type": spot.spot_type, "city": (spot.city or "").lower()})
+    clustering.LAYERS["spots"].add(spot.id, spot.latitude, spot.longitude,
+                                   {"name": spot.name, "type": spot.spot_type})
     return _row_to_dict(spot)
 
 
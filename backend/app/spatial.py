@@ -0,0 +1,189 @@
+"""In-memory spatial indexes for map layers.
+
+GridIndex buckets points into fixed lat/lng cells so radius and k-nearest
+queries only visit nearby cells, then ranks candidates by true haversine
+distance. PointLayer keeps one GridIndex per layer (walk spots, vets, ...)
+loaded from the DB on first use, refreshed after `ttl_seconds` so other
+workers' inserts show up, and updated in place on local inserts. Since
+inserts mutate the index, layers are queried through their own methods,
+which hold the layer lock.
+"""
+import math
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from .geo import haversine_km
+
+KM_PER_DEG = 111.195
+
+# (id, lat, lng, payload)
+Entry = Tuple[int, float, float, dict]
+
+
+class GridIndex:
+    def __init__(self, cell_deg: float = 0.05):
+        self.cell_deg = cell_deg
+        self._cells = defaultdict(list)
+        self._by_id = {}
+        self._bounds = None  # (min_i, min_j, max_i, max_j) of used cells
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._by_id
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def insert(self, id: int, lat: float, lng: float, payload: dict = None):
+        self.remove(id)
+        entry = (id, lat, lng, payload or {})
+        self._by_id[id] = entry
+        i, j = self._cell(lat, lng)
+        self._cells[(i, j)].append(entry)
+        b = self._bounds
+        self._bounds = (i, j, i, j) if b is None else (
+            min(b[0], i), min(b[1], j), max(b[2], i), max(b[3], j)
+        )
+
+    def remove(self, id: int):
+        entry = self._by_id.pop(id, None)
+        if entry:
+            cell = self._cells[self._cell(entry[1], entry[2])]
+            cell.remove(entry)
+
+    def entries(self) -> Iterable[Entry]:
+        return self._by_id.values()
+
+    def _ring(self, ci: int, cj: int, r: int):
+        if r == 0:
+            yield (ci, cj)
+            return
+        for j in range(cj - r, cj + r + 1):
+            yield (ci - r, j)
+            yield (ci + r, j)
+        for i in range(ci - r + 1, ci + r):
+            yield (i, cj - r)
+            yield (i, cj + r)
+
+    def within(self, lat: float, lng: float, radius_km: float,
+               predicate: Optional[Callable[[dict], bool]] = None) -> List[Tuple[float, Entry]]:
+        """Entries within `radius_km`, as (distance_km, entry), nearest first."""
+        dlat = radius_km / KM_PER_DEG
+        dlng = radius_km / (KM_PER_DEG * max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6))
+        i0, j0 = self._cell(lat - dlat, lng - dlng)
+        i1, j1 = self._cell(lat + dlat, lng + dlng)
+        hits = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for entry in self._cells.get((i, j), ()):
+                    if predicate and not predicate(entry[3]):
+                        continue
+                    d = haversine_km(lat, lng, entry[1], entry[2])
+                    if d <= radius_km:
+                        hits.append((d, entry))
+        hits.sort(key=lambda h: (h[0], h[1][0]))
+        return hits
+
+    def in_bbox(self, south: float, west: float, north: float, east: float) -> List[Entry]:
+        """Entries inside a lat/lng box; `west > east` crosses the antimeridian."""
+        if west > east:
+            return self.in_bbox(south, west, north, 180.0) + self.in_bbox(south, -180.0, north, east)
+        i0, j0 = self._cell(south, west)
+        i1, j1 = self._cell(north, east)
+        b = self._bounds
+        if b is None:
+            return []
+        i0, j0, i1, j1 = max(i0, b[0]), max(j0, b[1]), min(i1, b[2]), min(j1, b[3])
+        if (i1 - i0 + 1) * (j1 - j0 + 1) <= len(self._cells):
+            cells = (self._cells.get((i, j), ()) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1))
+        else:
+            # Box spans more cells than are occupied: walk the occupied ones
+            cells = (c for (i, j), c in self._cells.items() if i0 <= i <= i1 and j0 <= j <= j1)
+        return [
+            entry for cell in cells for entry in cell
+            if south <= entry[1] <= north and west <= entry[2] <= east
+        ]
+
+    def nearest(self, lat: float, lng: float, k: int,
+                predicate: Optional[Callable[[dict], bool]] = None,
+                max_radius_km: Optional[float] = None) -> List[Tuple[float, Entry]]:
+        """The `k` nearest entries, searching rings of cells outwards."""
+        if not self._by_id:
+            return []
+        ci, cj = self._cell(lat, lng)
+        found = []
+        r = 0
+        # Every indexed cell is at most this many rings away
+        b = self._bounds
+        max_ring = max(ci - b[0], cj - b[1], b[2] - ci, b[3] - cj, 0)
+        while r <= max_ring:
+            for cell in self._ring(ci, cj, r):
+                for entry in self._cells.get(cell, ()):
+                    if predicate and not predicate(entry[3]):
+                        continue
+                    found.append((haversine_km(lat, lng, entry[1], entry[2]), entry))
+            found.sort(key=lambda h: (h[0], h[1][0]))
+            # Points outside rings 0..r are at least r cells away
+            edge_lat = min(abs(lat) + (r + 1) * self.cell_deg, 89.9)
+            bound_km = r * self.cell_deg * KM_PER_DEG * math.cos(math.radians(edge_lat))
+            if len(found) >= k and found[k - 1][0] <= bound_km:
+                break
+            if max_radius_km is not None and bound_km > max_radius_km:
+                break
+            r += 1
+        if max_radius_km is not None:
+            found = [h for h in found if h[0] <= max_radius_km]
+        return found[:k]
+
+
+class PointLayer:
+    def __init__(self, name: str, loader: Callable[[Session], Iterable[Entry]],
+                 ttl_seconds: float = 300, cell_deg: float = 0.05):
+        self.name = name
+        self._loader = loader
+        self._ttl = ttl_seconds
+        self._cell_deg = cell_deg
+        self._lock = threading.Lock()
+        self._index = None
+        self._loaded_at = 0.0
+        self.version = 0
+
+    def _current(self, db: Session) -> GridIndex:
+        # Caller holds self._lock: inserts mutate the index in place
+        if self._index is None or time.monotonic() - self._loaded_at > self._ttl:
+            index = GridIndex(self._cell_deg)
+            for id, lat, lng, payload in self._loader(db):
+                if lat is not None and lng is not None:
+                    index.insert(id, lat, lng, payload)
+            self._index = index
+            self._loaded_at = time.monotonic()
+            self.version += 1
+        return self._index
+
+    def within(self, db: Session, *args, **kwargs) -> List[Tuple[float, Entry]]:
+        with self._lock:
+            return self._current(db).within(*args, **kwargs)
+
+    def nearest(self, db: Session, *args, **kwargs) -> List[Tuple[float, Entry]]:
+        with self._lock:
+            return self._current(db).nearest(*args, **kwargs)
+
+    def in_bbox(self, db: Session, *args) -> List[Entry]:
+        with self._lock:
+            return self._current(db).in_bbox(*args)
+
+    def add(self, id: int, lat: Optional[float], lng: Optional[float], payload: dict = None):
+        with self._lock:
+            if self._index is not None and lat is not None and lng is not None:
+                self._index.insert(id, lat, lng, payload)
+                self.version += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
@@ -0,0 +1,111 @@
+"""In-memory training catalog.
+
+Programs and their steps are a small, read-mostly catalog, so they are
+held as one immutable snapshot with each program's step count precomputed;
+program listings, details and progress pages read it without touching the
+DB. A background job, which also runs at startup, compares a cheap
+fingerprint of both tables (row count, last id, last `updated_at`) and
+swaps in a fresh snapshot, with a new `version`, when it changed. Without
+the scheduler the snapshot is loaded on first use; in-process writers can
+call `invalidate()`.
+"""
+import threading
+from typing import Dict, List, Optional
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import background, models
+
+CHECK_EVERY_SECONDS = 60
+
+
+def _program_dict(p: models.TrainingProgram) -> dict:
+    return {
+        "id": p.id,
+        "title": p.title,
+        "description": p.description,
+        "difficulty": p.difficulty,
+        "category": p.category,
+        "duration_weeks": p.duration_weeks,
+        "image_url": p.image_url,
+    }
+
+
+def _step_dict(s: models.TrainingStep) -> dict:
+    return {
+        "id": s.id,
+        "step_number": s.step_number,
+        "title": s.title,
+        "description": s.description,
+        "tips": s.tips,
+        "duration_minutes": s.duration_minutes,
+    }
+
+
+class Catalog:
+    def __init__(self, programs, steps, fingerprint, version: int):
+        self.fingerprint = fingerprint
+        self.version = version
+        ordered = sorted(programs, key=lambda p: (p.title, p.id))
+        self.programs: Dict[int, dict] = {p.id: _program_dict(p) for p in ordered}
+        self.steps: Dict[int, List[dict]] = {p.id: [] for p in ordered}
+        for s in sorted(steps, key=lambda s: (s.step_number, s.id)):
+            self.steps.setdefault(s.program_id, []).append(_step_dict(s))
+        self.step_counts: Dict[int, int] = {pid: len(s) for pid, s in self.steps.items()}
+
+    def program(self, program_id: int) -> Optional[dict]:
+        return self.programs.get(program_id)
+
+    def list(self, difficulty: Optional[str] = None, category: Optional[str] = None) -> List[dict]:
+        return [
+            p for p in self.programs.values()
+            if (not difficulty or p["difficulty"] == difficulty)
+            and (not category or p["category"] == category)
+        ]
+
+
+_lock = threading.Lock()
+_catalog: Optional[Catalog] = None
+_version = 0
+
+
+def _fingerprint(db: Session) -> tuple:
+    P, S = models.TrainingProgram, models.TrainingStep
+    return (
+        tuple(db.query(func.count(P.id), func.max(P.id), func.max(P.updated_at)).one())
+        + tuple(db.query(func.count(S.id), func.max(S.id), func.max(S.updated_at)).one())
+    )
+
+
+def refresh(db: Session) -> Catalog:
+    """Reload the snapshot if the tables changed since it was built."""
+    global _catalog, _version
+    with _lock:
+        fingerprint = _fingerprint(db)
+        if _catalog is None or _catalog.fingerprint != fingerprint:
+            _version += 1
+            _catalog = Catalog(
+                db.query(models.TrainingProgram).all(),
+                db.query(models.TrainingStep).all(),
+                fingerprint,
+                _version,
+            )
+        return _catalog
+
+
+def get(db: Session) -> Catalog:
+    catalog = _catalog
+    return catalog if catalog is not None else refresh(db)
+
+
+def invalidate():
+    """Force a reload on next use."""
+    global _catalog
+    with _lock:
+        _catalog = None
+
+
+@background.register("training_catalog", CHECK_EVERY_SECONDS)
+def check_catalog(db: Session):
+    refresh(db)
@@ -0,0 +1,115 @@
+"""WoofSocial trending feed.
+
+A background job scores recent posts from their likes and comments, each
+event decaying with a configurable half-life, and keeps the top-N posts
+globally and per city in memory. Readers only ever touch the snapshot.
+"""
+import heapq
+import math
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import Session
+
+from . import background, models
+
+HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "24"))
+WINDOW_DAYS = int(os.getenv("TRENDING_WINDOW_DAYS", "7"))
+TOP_N = int(os.getenv("TRENDING_TOP_N", "100"))
+REFRESH_SECONDS = int(os.getenv("TRENDING_REFRESH_SECONDS", "120"))
+
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+
+_CHUNK = 500
+
+
+def _decay(age: timedelta) -> float:
+    hours = max(age.total_seconds(), 0) / 3600
+    return math.exp(-math.log(2) * hours / HALF_LIFE_HOURS)
+
+
+class TrendingFeed:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = []
+        self._by_city = {}
+        self.refreshed_at = None
+
+    def refresh(self, db: Session, now: datetime = None):
+        now = now or datetime.utcnow()
+        since = now - timedelta(days=WINDOW_DAYS)
+
+        scores = defaultdict(float)
+        events = [
+            (models.PostLike, LIKE_WEIGHT),
+            (models.PostComment, COMMENT_WEIGHT),
+        ]
+        for model, weight in events:
+            rows = (
+                db.query(model.post_id, model.created_at)
+                .filter(model.created_at >= since)
+                .all()
+            )
+            for post_id, created_at in rows:
+                scores[post_id] += weight * _decay(now - created_at)
+
+        entries = []
+        post_ids = list(scores)
+        for i in range(0, len(post_ids), _CHUNK):
+            rows = (
+                db.query(models.Post, models.User)
+                .join(models.User, models.Post.user_id == models.User.id)
+                .filter(
+                    models.Post.id.in_(post_ids[i:i + _CHUNK]),
+                    models.Post.deleted_at.is_(None),
+                    models.User.deleted_at.is_(None),
+                )
+                .all()
+            )
+            for post, user in rows:
+                entries.append({
+                    "id": post.id,
+                    "user_id": post.user_id,
+                    "user_name": user.full_name,
+                    "user_avatar": user.avatar_url,
+                    "user_city": user.city,
+                    "dog_id": post.dog_id,
+                    "content": post.content,
+                    "photo_url": post.photo_url,
+                    "likes_count": post.likes_count,
+                    "comments_count": post.comments_count,
+                    "score": round(scores[post.id], 4),
+                    "created_at": post.created_at.isoformat() if post.created_at else None,
+                })
+
+        by_city = defaultdict(list)
+        for entry in entries:
+            if entry["user_city"]:
+                by_city[entry["user_city"].strip().lower()].append(entry)
+
+        def rank(items):
+            return heapq.nlargest(TOP_N, items, key=lambda e: (e["score"], e["id"]))
+
+        ranked_global = rank(entries)
+        ranked_by_city = {city: rank(items) for city, items in by_city.items()}
+        with self._lock:
+            self._global = ranked_global
+            self._by_city = ranked_by_city
+            self.refreshed_at = now
+
+    def get(self, city: str = None) -> list:
+        with self._lock:
+            if city:
+                return self._by_city.get(city.strip().lower(), [])
+            return self._global
+
+
+feed = TrendingFeed()
+
+
+@background.register("trending", REFRESH_SECONDS)
+def refresh_trending(db: Session):
+    feed.refresh(db)
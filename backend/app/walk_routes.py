@@ -0,0 +1,89 @@
+"""Storage of walk routes: simplification, zoom levels and cold archive.
+
+On ingest the raw track is simplified with Douglas-Peucker. The finest level
+(WALK_ROUTE_TOLERANCE_M) becomes `Walk.route_polyline`; coarser levels for
+zoomed-out maps go to `walk_route_levels`. When WALK_ROUTE_ARCHIVE=1 the
+full-resolution track is also written gzip-compressed under DATA_DIR.
+"""
+import gzip
+import os
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import models, polyline
+from .database import DATA_DIR
+from .geo import Point, simplify
+
+TOLERANCE_M = float(os.getenv("WALK_ROUTE_TOLERANCE_M", "2"))
+ARCHIVE_ENABLED = os.getenv("WALK_ROUTE_ARCHIVE", "0") == "1"
+ARCHIVE_DIR = os.path.join(DATA_DIR, "route_archive")
+
+# (max_zoom, tolerance in metres) for the coarser levels, finest first.
+# Zooms above the first max_zoom use Walk.route_polyline.
+LEVELS = [(14, 8.0), (12, 30.0), (10, 120.0)]
+
+
+def _archive_path(walk_id: int) -> str:
+    return os.path.join(ARCHIVE_DIR, f"{walk_id}.polyline.gz")
+
+
+def store_route(db: Session, walk: models.Walk, points: List[Point]):
+    """Simplify `points` into `walk` and its zoom levels. Flushes the session
+    if the walk has no id yet; the caller commits."""
+    if walk.id is None:
+        db.add(walk)
+        db.flush()
+    db.query(models.WalkRouteLevel).filter(
+        models.WalkRouteLevel.walk_id == walk.id
+    ).delete(synchronize_session=False)
+
+    if ARCHIVE_ENABLED and points:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        with gzip.open(_archive_path(walk.id), "wt") as f:
+            f.write(polyline.encode(points))
+
+    finest = simplify(points, TOLERANCE_M)
+    walk.route_polyline = polyline.encode(finest)
+    previous = finest
+    for max_zoom, tolerance in LEVELS:
+        level = simplify(previous, tolerance)
+        if len(level) == len(previous):
+            # Coarser tolerance removed nothing more; the previous level serves
+            break
+        db.add(models.WalkRouteLevel(
+            walk_id=walk.id,
+            max_zoom=max_zoom,
+            tolerance_m=tolerance,
+            route_polyline=polyline.encode(level),
+        ))
+        previous = level
+
+
+def load_polyline(db: Session, walk: models.Walk, zoom: Optional[int] = None, full: bool = False) -> str:
+    """Encoded route for display at `zoom`, or the archived raw track."""
+    if full and os.path.exists(_archive_path(walk.id)):
+        with gzip.open(_archive_path(walk.id), "rt") as f:
+            return f.read()
+    if zoom is not None:
+        level = (
+            db.query(models.WalkRouteLevel)
+            .filter(
+                models.WalkRouteLevel.walk_id == walk.id,
+                models.WalkRouteLevel.max_zoom >= zoom,
+            )
+            .order_by(models.WalkRouteLevel.max_zoom.asc())
+            .first()
+        )
+        if level:
+            return level.route_polyline
+    return walk.route_polyline or ""
+
+
+def remove_archives(db: Session, walk_ids: list):
+    """Deletion hook: drop archived tracks of purged walks."""
+    for walk_id in walk_ids:
+        try:
+            os.remove(_archive_path(walk_id))
+        except FileNotFoundError:
+            pass
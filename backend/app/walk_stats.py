@@ -0,0 +1,115 @@
+"""Walk statistics rollups.
+
+Each completed walk is added to its dog's day, week, month and all-time
+buckets with atomic increments, so dashboards read a handful of rows instead
+of aggregating the whole walk history. Dogs whose walks predate the rollups
+are backfilled once, on first read.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+PERIODS = ("day", "week", "month", "all")
+ALL_TIME = datetime(1970, 1, 1)
+
+
+def period_start(period: str, ts: datetime) -> datetime:
+    day = datetime(ts.year, ts.month, ts.day)
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return datetime(ts.year, ts.month, 1)
+    return ALL_TIME
+
+
+def next_period_start(period: str, start: datetime) -> datetime:
+    if period == "day":
+        return start + timedelta(days=1)
+    if period == "week":
+        return start + timedelta(weeks=1)
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def _increment(db: Session, dog_id: int, period: str, start: datetime, walk: models.Walk):
+    R = models.WalkStatsRollup
+    values = {
+        R.walks: R.walks + 1,
+        R.distance_km: R.distance_km + (walk.distance_km or 0),
+        R.duration_minutes: R.duration_minutes + (walk.duration_minutes or 0),
+        R.calories: R.calories + (walk.calories or 0),
+        R.updated_at: datetime.utcnow(),
+    }
+    bucket = db.query(R).filter(R.dog_id == dog_id, R.period == period, R.period_start == start)
+    if bucket.update(values, synchronize_session=False):
+        return
+    try:
+        with db.begin_nested():
+            db.add(R(
+                dog_id=dog_id, period=period, period_start=start, walks=1,
+                distance_km=walk.distance_km or 0,
+                duration_minutes=walk.duration_minutes or 0,
+                calories=walk.calories or 0,
+            ))
+    except IntegrityError:
+        # Another request created the bucket first
+        bucket.update(values, synchronize_session=False)
+
+
+def record_walk(db: Session, walk: models.Walk):
+    """Add a completed walk to its rollups; the caller commits."""
+    db.flush()
+    if not ensure_rollups(db, walk.dog_id):
+        return
+    for period in PERIODS:
+        _increment(db, walk.dog_id, period, period_start(period, walk.start_time), walk)
+
+
+def ensure_rollups(db: Session, dog_id: int) -> bool:
+    """Backfill a dog's rollups from its walks if they were never built.
+
+    Returns False when a backfill ran (it already covers every walk)."""
+    has_all = db.query(models.WalkStatsRollup.id).filter(
+        models.WalkStatsRollup.dog_id == dog_id,
+        models.WalkStatsRollup.period == "all",
+    ).first()
+    if has_all:
+        return True
+    rebuild(db, dog_id)
+    return False
+
+
+def rebuild(db: Session, dog_id: int):
+    R = models.WalkStatsRollup
+    db.query(R).filter(R.dog_id == dog_id).delete(synchronize_session=False)
+    buckets = defaultdict(lambda: [0, 0.0, 0, 0])
+    buckets[("all", ALL_TIME)]  # always written, even with no walks, marks the dog as built
+    walks = db.query(
+        models.Walk.start_time, models.Walk.distance_km,
+        models.Walk.duration_minutes, models.Walk.calories,
+    ).filter(
+        models.Walk.dog_id == dog_id,
+        or_(models.Walk.status.is_(None), models.Walk.status != "live"),
+    )
+    for start_time, distance_km, duration_minutes, calories in walks:
+        for period in PERIODS:
+            b = buckets[(period, period_start(period, start_time))]
+            b[0] += 1
+            b[1] += distance_km or 0
+            b[2] += duration_minutes or 0
+            b[3] += calories or 0
+    for (period, start), (n, distance_km, duration_minutes, calories) in buckets.items():
+        db.add(R(
+            dog_id=dog_id, period=period, period_start=start, walks=n,
+            distance_km=distance_km, duration_minutes=duration_minutes,
+            calories=calories,
+        ))
+    db.flush()
@@ -0,0 +1,45 @@
+import os
+import tempfile
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp())
+os.environ["BACKGROUND_JOBS"] = "0"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import models  # noqa: E402
+from app.database import SessionLocal  # noqa: E402
+from app.main import app  # noqa: E402
+
+client = TestClient(app)
+
+
+def _login():
+    r = client.post("/api/auth/login", data={"username": "marie@example.com", "password": "demo1234"})
+    assert r.status_code == 200, r.text
+    return {"Authorization": "Bearer " + r.json()["access_token"]}
+
+
+def test_batch_mixes_aware_and_naive_timestamps():
+    headers = _login()
+    dog_id = client.get("/api/dogs", headers=headers).json()[0]["id"]
+    r = client.post("/api/food/meals/batch", headers=headers, json={"meals": [
+        {"dog_id": dog_id, "amount_g": 100, "timestamp": "2030-03-01T23:30:00-02:00"},
+        {"dog_id": dog_id, "amount_g": 50, "timestamp": "2030-03-01T10:00:00"},
+        {"dog_id": dog_id, "amount_g": 25},
+    ]})
+    assert r.status_code == 200, r.text
+
+    db = SessionLocal()
+    try:
+        days = {
+            row.day.date().isoformat(): row.meals
+            for row in db.query(models.NutritionDailyRollup).filter(
+                models.NutritionDailyRollup.dog_id == dog_id,
+                models.NutritionDailyRollup.day >= "2030-03-01",
+                models.NutritionDailyRollup.day < "2030-04-01",
+            )
+        }
+    finally:
+        db.close()
+    # 23:30 at UTC-2 is 01:30 UTC the next day
+    assert days == {"2030-03-01": 1, "2030-03-02": 1}